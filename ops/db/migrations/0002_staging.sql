@@ -0,0 +1,23 @@
+-- Unlogged staging tables for the bulk loader (ops/ingestion/db_writer.py).
+-- Rows are COPY'd here per batch and merged into documents/chunks with
+-- set-based INSERT ... SELECT ... ON CONFLICT; contents are transient.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS staging_documents (
+  source_url text NOT NULL,
+  source_host text NOT NULL,
+  file_sha256 text,
+  page_count integer,
+  ocr_quality real
+);
+
+CREATE UNLOGGED TABLE IF NOT EXISTS staging_chunks (
+  source_url text NOT NULL,
+  page_no integer NOT NULL,
+  chunk_no integer NOT NULL,
+  text text,
+  start_char integer,
+  end_char integer,
+  chunk_sha256 text
+);
+
+CREATE INDEX IF NOT EXISTS staging_chunks_source_url_idx ON staging_chunks (source_url);
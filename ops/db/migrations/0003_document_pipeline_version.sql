@@ -0,0 +1,5 @@
+-- Records which pipeline version produced a document's chunks, so load-db can
+-- skip documents whose bytes and chunking are both unchanged.
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS pipeline_version text;
+ALTER TABLE staging_documents ADD COLUMN IF NOT EXISTS pipeline_version text;
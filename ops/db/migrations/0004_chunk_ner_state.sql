@@ -0,0 +1,12 @@
+-- Per-chunk NER bookkeeping (ops/ner): which model and chunk text hash the
+-- current entity_mentions of a chunk were produced from. Chunks without a
+-- row, with a different model, or whose chunk_sha256 changed are re-run.
+
+CREATE TABLE IF NOT EXISTS chunk_ner_state (
+  chunk_id uuid PRIMARY KEY REFERENCES chunks(id) ON DELETE CASCADE,
+  model text NOT NULL,
+  chunk_sha256 text,
+  processed_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS chunk_ner_state_processed_at_idx ON chunk_ner_state (processed_at);
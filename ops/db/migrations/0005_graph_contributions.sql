@@ -0,0 +1,17 @@
+-- Incremental graph maintenance (ops/graph). Each document's contribution to
+-- edge weights is kept so a changed document can be subtracted and re-added
+-- without rebuilding the graph. No FK to documents: contributions of deleted
+-- documents must still be found and subtracted.
+
+CREATE TABLE IF NOT EXISTS graph_doc_contributions (
+  doc_id uuid NOT NULL,
+  entity_a_id uuid NOT NULL,
+  entity_b_id uuid NOT NULL,
+  edge_type edge_type NOT NULL,
+  weight real NOT NULL,
+  PRIMARY KEY (doc_id, entity_a_id, entity_b_id, edge_type)
+);
+
+-- Change detection since the last graph run's watermark.
+CREATE INDEX IF NOT EXISTS entity_mentions_created_at_idx ON entity_mentions (created_at);
+CREATE INDEX IF NOT EXISTS documents_updated_at_idx ON documents (updated_at);
@@ -0,0 +1,13 @@
+-- Entity canonicalization (ops/ner/canonicalize.py). Every normalized name
+-- (ops/ner/aliases.py normalize_name) maps to one entity; NER resolves new
+-- mentions through this table, and merged entities leave their names here.
+
+CREATE TABLE IF NOT EXISTS entity_aliases (
+  alias text NOT NULL,
+  type entity_type NOT NULL,
+  entity_id uuid NOT NULL REFERENCES entities(id) ON DELETE CASCADE,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (alias, type)
+);
+
+CREATE INDEX IF NOT EXISTS entity_aliases_entity_id_idx ON entity_aliases (entity_id);
@@ -0,0 +1,12 @@
+-- What the Meilisearch chunks index holds for each chunk when records are
+-- built from Postgres (ops/ingestion/cli.py index --source postgres). No FK to
+-- chunks: rows of deleted chunks are how their search documents get deleted.
+
+CREATE TABLE IF NOT EXISTS chunk_index_state (
+  chunk_id uuid PRIMARY KEY,
+  meili_id text NOT NULL,
+  fingerprint text NOT NULL,
+  indexed_at timestamptz NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS chunk_index_state_meili_id_idx ON chunk_index_state (meili_id);
@@ -0,0 +1,18 @@
+-- Watermark shared by the incremental jobs that read rows changed since their
+-- last run (ops/graph refresh, ops/ingestion index --source postgres): the
+-- start of the oldest transaction still open elsewhere. Rows committed after
+-- a run began can carry an earlier created_at/processed_at, and must still be
+-- at or after the watermark the next run starts from; callers compare with >=
+-- because such a transaction's rows carry exactly its xact_start.
+--
+-- pg_stat_activity only shows xact_start for other roles' sessions when the
+-- calling role is a superuser or has pg_read_all_stats; without it those
+-- transactions are invisible and the watermark silently becomes now(). Run
+-- the jobs as the role that writes the rows, or grant pg_read_all_stats.
+
+CREATE OR REPLACE FUNCTION sync_watermark() RETURNS timestamptz
+LANGUAGE sql AS $$
+  SELECT LEAST(now(), min(xact_start))
+  FROM pg_stat_activity
+  WHERE datname = current_database() AND pid <> pg_backend_pid()
+$$;
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Benchmark near-pair generation on synthetic dense chunks.
+
+Compares the sweep line in build.near_pairs with checking every pair of
+mentions, on chunks shaped like flight logs / contact lists (hundreds of
+names per chunk), and checks both produce the same pairs.
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from itertools import combinations
+
+from build import Mention, near_pairs
+
+
+def synthetic_chunk(
+    rng: random.Random, *, mentions: int, entities: int, chunk_no: int
+) -> list[Mention]:
+    # Names of 5-20 chars separated by 1-40 chars, like a dense listing.
+    rows = []
+    pos = 0
+    for _ in range(mentions):
+        pos += rng.randint(1, 40)
+        length = rng.randint(5, 20)
+        rows.append(
+            Mention(
+                entity_id=f"e{rng.randrange(entities):06d}",
+                doc_id="bench",
+                page_no=1,
+                chunk_no=chunk_no,
+                chunk_id=f"c{chunk_no}",
+                start_char=pos,
+                end_char=pos + length,
+            )
+        )
+        pos += length
+    rng.shuffle(rows)
+    return rows
+
+
+def all_pairs(mentions: list[Mention], window: int) -> set:
+    found = set()
+    for a, b in combinations(mentions, 2):
+        if a.entity_id == b.entity_id:
+            continue
+        first, second = (a, b) if (a.start_char, a.end_char) <= (b.start_char, b.end_char) else (b, a)
+        gap = max(0, second.start_char - first.end_char)
+        if gap <= window:
+            found.add((first, second, gap))
+    return found
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=50)
+    parser.add_argument("--mentions", type=int, default=1000, help="Mentions per chunk")
+    parser.add_argument("--entities", type=int, default=5000, help="Distinct entity pool")
+    parser.add_argument("--window", type=int, default=60, help="Window in chars")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    chunks = [
+        synthetic_chunk(rng, mentions=args.mentions, entities=args.entities, chunk_no=i)
+        for i in range(args.chunks)
+    ]
+
+    started = time.perf_counter()
+    sweep = [set(near_pairs(chunk, args.window)) for chunk in chunks]
+    sweep_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    naive = [all_pairs(chunk, args.window) for chunk in chunks]
+    naive_seconds = time.perf_counter() - started
+
+    pairs = sum(len(found) for found in sweep)
+    if sweep != naive:
+        raise SystemExit("sweep line and all-pairs results differ")
+
+    total = args.chunks * args.mentions
+    print(f"{args.chunks} chunks x {args.mentions} mentions, window {args.window} chars")
+    print(f"near pairs: {pairs}")
+    print(f"sweep line: {sweep_seconds:.3f}s ({total / sweep_seconds:,.0f} mentions/s)")
+    print(f"all pairs:  {naive_seconds:.3f}s ({total / naive_seconds:,.0f} mentions/s)")
+    print(f"speedup:    {naive_seconds / sweep_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import bisect
+import heapq
+import re
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from itertools import combinations
+from typing import Iterator
+
+# Per PLAN.md: co-occurrence in a paragraph (chunk) is strong evidence,
+# co-occurrence in a document is weak.
+CO_PARAGRAPH_SCORE = 1.0
+CO_DOC_SCORE = 0.5
+TOKEN_RE = re.compile(r"\S+")
+
+# (entity_a_id, entity_b_id, edge_type) with entity_a_id < entity_b_id.
+# Lowercase UUID strings sort exactly like Postgres uuid values, so the
+# CHECK (entity_a_id < entity_b_id) constraint holds.
+EdgeKey = tuple[str, str, str]
+
+
+@dataclass(frozen=True)
+class Mention:
+    entity_id: str
+    doc_id: str
+    page_no: int
+    chunk_no: int
+    chunk_id: str
+    start_char: int | None
+    end_char: int | None
+    # Filled by the reader when near edges are measured in tokens.
+    start_token: int | None = None
+    end_token: int | None = None
+
+
+@dataclass(frozen=True)
+class Evidence:
+    doc_id: str
+    page_no: int
+    chunk_id: str
+    start_char: int | None
+    end_char: int | None
+    score: float
+
+
+@dataclass
+class GraphDelta:
+    weights: Counter = field(default_factory=Counter)
+    evidence: dict[EdgeKey, list[Evidence]] = field(default_factory=dict)
+    # (doc_id, edge key, weight) per document, so the document's share can be
+    # subtracted again when it changes.
+    contributions: list[tuple[str, EdgeKey, float]] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.weights)
+
+    def add(self, other: "GraphDelta") -> None:
+        self.weights.update(other.weights)
+        for key, rows in other.evidence.items():
+            self.evidence.setdefault(key, []).extend(rows)
+        self.contributions.extend(other.contributions)
+
+    def add_pair(self, key: EdgeKey, evidence: Evidence, max_evidence: int) -> None:
+        self.weights[key] += 1
+        rows = self.evidence.setdefault(key, [])
+        if len(rows) < max_evidence:
+            rows.append(evidence)
+
+
+def doc_edges(
+    mentions: list[Mention],
+    *,
+    max_entities: int = 50,
+    max_evidence: int = 3,
+    near_window: int = 0,
+    near_unit: str = "chars",
+) -> GraphDelta:
+    # Edges contributed by one document. Only the document's max_entities
+    # most-mentioned entities take part, which bounds the work per document
+    # to max_entities^2 / 2 pairs per edge type (an index page listing 500
+    # names would otherwise produce 125k pairs). max_evidence caps evidence
+    # rows per edge for this document. near_window > 0 also emits near edges
+    # between mentions at most near_window chars/tokens apart.
+    counts = Counter(mention.entity_id for mention in mentions)
+    kept = {
+        entity_id
+        for entity_id, _ in sorted(counts.items(), key=lambda item: (-item[1], item[0]))[
+            :max_entities
+        ]
+    }
+
+    by_chunk: dict[str, dict[str, Mention]] = defaultdict(dict)
+    chunk_mentions_all: dict[str, list[Mention]] = defaultdict(list)
+    first: dict[str, Mention] = {}
+    for mention in sorted(mentions, key=mention_order):
+        if mention.entity_id not in kept:
+            continue
+        by_chunk[mention.chunk_id].setdefault(mention.entity_id, mention)
+        chunk_mentions_all[mention.chunk_id].append(mention)
+        first.setdefault(mention.entity_id, mention)
+
+    delta = GraphDelta()
+    for chunk_mentions in by_chunk.values():
+        for a, b in combinations(sorted(chunk_mentions), 2):
+            delta.add_pair(
+                (a, b, "co_paragraph"),
+                span_evidence(chunk_mentions[a], chunk_mentions[b], CO_PARAGRAPH_SCORE),
+                max_evidence,
+            )
+
+    if near_window > 0:
+        for chunk_mentions in chunk_mentions_all.values():
+            for (a, b), (ma, mb, gap) in closest_near_pairs(
+                chunk_mentions, near_window, near_unit
+            ).items():
+                score = round(1 - gap / (near_window + 1), 4)
+                delta.add_pair((a, b, "near"), span_evidence(ma, mb, score), max_evidence)
+
+    for a, b in combinations(sorted(first), 2):
+        key = (a, b, "co_doc")
+        delta.add_pair(key, mention_evidence(first[a], CO_DOC_SCORE), max_evidence)
+        if len(delta.evidence[key]) < max_evidence:
+            delta.evidence[key].append(mention_evidence(first[b], CO_DOC_SCORE))
+
+    if mentions:
+        doc_id = mentions[0].doc_id
+        delta.contributions = [(doc_id, key, weight) for key, weight in delta.weights.items()]
+    return delta
+
+
+def mention_order(mention: Mention) -> tuple:
+    return (mention.page_no, mention.chunk_no, mention.start_char or 0)
+
+
+def mention_evidence(mention: Mention, score: float) -> Evidence:
+    return Evidence(
+        mention.doc_id,
+        mention.page_no,
+        mention.chunk_id,
+        mention.start_char,
+        mention.end_char,
+        score,
+    )
+
+
+def span_evidence(a: Mention, b: Mention, score: float) -> Evidence:
+    # Both mentions are in the same chunk; the evidence span covers both.
+    starts = [pos for pos in (a.start_char, b.start_char) if pos is not None]
+    ends = [pos for pos in (a.end_char, b.end_char) if pos is not None]
+    return Evidence(
+        a.doc_id,
+        a.page_no,
+        a.chunk_id,
+        min(starts) if starts else None,
+        max(ends) if ends else None,
+        score,
+    )
+
+
+def mention_span(mention: Mention, unit: str) -> tuple[int, int] | None:
+    if unit == "tokens":
+        start, end = mention.start_token, mention.end_token
+    else:
+        start, end = mention.start_char, mention.end_char
+    if start is None or end is None:
+        return None
+    return start, end
+
+
+def near_pairs(
+    mentions: list[Mention], window: int, unit: str = "chars"
+) -> Iterator[tuple[Mention, Mention, int]]:
+    # Sweep line over one chunk: mentions are visited by start position while
+    # a min-heap on end position holds those still within `window` of the
+    # sweep. Mentions that fell out of range are popped once, so the cost is
+    # O(n log n) plus one step per emitted pair instead of comparing all
+    # n^2 / 2 pairs. Yields (earlier, later, gap) for distinct entities;
+    # overlapping mentions have gap 0.
+    spans = []
+    for mention in mentions:
+        span = mention_span(mention, unit)
+        if span is not None:
+            spans.append((span[0], span[1], mention))
+    spans.sort(key=lambda item: (item[0], item[1]))
+
+    active: list[tuple[int, int, Mention]] = []
+    for order, (start, end, mention) in enumerate(spans):
+        while active and active[0][0] < start - window:
+            heapq.heappop(active)
+        for other_end, _, other in active:
+            if other.entity_id != mention.entity_id:
+                yield other, mention, max(0, start - other_end)
+        heapq.heappush(active, (end, order, mention))
+
+
+def closest_near_pairs(
+    mentions: list[Mention], window: int, unit: str = "chars"
+) -> dict[tuple[str, str], tuple[Mention, Mention, int]]:
+    # One entry per entity pair in the chunk, keeping the closest occurrence
+    # as evidence; keys are sorted entity ids.
+    closest: dict[tuple[str, str], tuple[Mention, Mention, int]] = {}
+    for first_mention, second_mention, gap in near_pairs(mentions, window, unit):
+        a, b = sorted((first_mention.entity_id, second_mention.entity_id))
+        current = closest.get((a, b))
+        if current is None or gap < current[2]:
+            closest[(a, b)] = (first_mention, second_mention, gap)
+    return closest
+
+
+def token_offsets(text: str) -> list[int]:
+    return [match.start() for match in TOKEN_RE.finditer(text)]
+
+
+def token_index(offsets: list[int], char_pos: int) -> int:
+    # Index of the token containing (or following) char_pos.
+    return max(0, bisect.bisect_right(offsets, char_pos) - 1)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import os
+import time
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Build co-occurrence edges from entity mentions")
+    parser.add_argument(
+        "--database-url",
+        default="",
+        help="Postgres connection string (or set DATABASE_URL)",
+    )
+    parser.add_argument(
+        "--max-entities-per-doc",
+        type=int,
+        default=50,
+        help="Only the N most-mentioned entities of a document form pairs",
+    )
+    parser.add_argument(
+        "--max-evidence-per-doc",
+        type=int,
+        default=3,
+        help="Max evidence rows per edge per document",
+    )
+    parser.add_argument(
+        "--flush-edges",
+        type=int,
+        default=200_000,
+        help="Write aggregated edges to Postgres once this many are in memory",
+    )
+    parser.add_argument(
+        "--near-window",
+        type=int,
+        default=10,
+        help="Emit near edges between mentions at most N units apart (0 disables)",
+    )
+    parser.add_argument(
+        "--near-unit",
+        choices=["tokens", "chars"],
+        default="tokens",
+        help="Unit for --near-window",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Rebuild the whole graph instead of refreshing changed documents",
+    )
+    return parser
+
+
+def main() -> None:
+    parser = build_parser()
+    args = parser.parse_args()
+
+    database_url = args.database_url or os.environ.get("DATABASE_URL", "")
+    if not database_url:
+        raise SystemExit("DATABASE_URL is required")
+
+    try:
+        import psycopg
+    except ModuleNotFoundError as exc:  # pragma: no cover - runtime dependency
+        raise ModuleNotFoundError(
+            "psycopg is required. Install with: pip install -r ops/requirements.txt"
+        ) from exc
+
+    from build import GraphDelta, doc_edges
+    from db import (
+        changed_doc_ids,
+        drop_empty_edges,
+        iter_doc_mentions,
+        last_watermark,
+        next_watermark,
+        record_job,
+        reset_graph,
+        subtract_docs,
+        write_delta,
+    )
+
+    started = time.perf_counter()
+    docs = 0
+    pairs = 0
+    edges = 0
+    dropped = 0
+
+    # Mentions are streamed on one connection; the refresh is written on
+    # another in a single transaction, so readers never see a half-built graph.
+    with psycopg.connect(database_url) as read_conn, psycopg.connect(database_url) as conn:
+        with conn.cursor() as cur:
+            watermark = next_watermark(cur)
+            since = None if args.full else last_watermark(cur)
+            if since is None:
+                mode = "full"
+                doc_ids = None
+                reset_graph(cur)
+            else:
+                # Only documents whose mentions changed since the last run:
+                # their old contributions are subtracted and the current
+                # ones added back, so cost follows the new data.
+                mode = "incremental"
+                doc_ids = changed_doc_ids(cur, since)
+                subtract_docs(cur, doc_ids)
+
+            delta = GraphDelta()
+            doc_mentions = iter_doc_mentions(
+                read_conn,
+                doc_ids=doc_ids,
+                with_tokens=args.near_window > 0 and args.near_unit == "tokens",
+            )
+            for _, mentions in doc_mentions:
+                doc_delta = doc_edges(
+                    mentions,
+                    max_entities=args.max_entities_per_doc,
+                    max_evidence=args.max_evidence_per_doc,
+                    near_window=args.near_window,
+                    near_unit=args.near_unit,
+                )
+                docs += 1
+                pairs += sum(doc_delta.weights.values())
+                delta.add(doc_delta)
+                if len(delta) >= args.flush_edges:
+                    write_delta(cur, delta)
+                    delta = GraphDelta()
+            write_delta(cur, delta)
+            if doc_ids is not None:
+                dropped = drop_empty_edges(cur)
+
+            cur.execute("SELECT count(*) FROM edges")
+            edges = cur.fetchone()[0]
+            elapsed = time.perf_counter() - started
+            record_job(
+                cur,
+                "graph",
+                stats={
+                    "mode": mode,
+                    "watermark": watermark,
+                    "documents": docs,
+                    "pairs": pairs,
+                    "dropped_edges": dropped,
+                    "edges": edges,
+                    "seconds": elapsed,
+                },
+            )
+        conn.commit()
+
+    print(
+        f"Graph {mode} refresh: {pairs} pairs from {docs} documents, "
+        f"{dropped} edges dropped, {edges} edges total in {elapsed:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
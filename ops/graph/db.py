@@ -0,0 +1,252 @@
+from __future__ import annotations
+
+from itertools import groupby
+from typing import Iterator
+
+from build import GraphDelta, Mention, token_index, token_offsets
+
+EDGE_COLUMNS = ("entity_a_id", "entity_b_id", "edge_type", "weight")
+EVIDENCE_COLUMNS = (
+    "edge_id",
+    "doc_id",
+    "page_no",
+    "chunk_id",
+    "start_char",
+    "end_char",
+    "evidence_score",
+)
+
+
+CONTRIBUTION_COLUMNS = ("doc_id", "entity_a_id", "entity_b_id", "edge_type", "weight")
+
+
+def iter_doc_mentions(
+    conn,
+    *,
+    doc_ids: list[str] | None = None,
+    with_tokens: bool = False,
+    fetch_size: int = 10_000,
+) -> Iterator[tuple[str, list[Mention]]]:
+    # Server-side cursor ordered by document: mentions are streamed and
+    # grouped one document at a time, never loaded as a whole. doc_ids limits
+    # the scan to the documents being refreshed. with_tokens also fills token
+    # positions; the chunk text is sent once per chunk, not once per mention.
+    doc_clause = "WHERE m.doc_id = ANY(%s::uuid[])" if doc_ids is not None else ""
+    text_column = (
+        "CASE WHEN row_number() OVER chunk_rows = 1 THEN c.text END"
+        if with_tokens
+        else "NULL"
+    )
+    with conn.cursor(name="graph_mentions") as cur:
+        cur.itersize = fetch_size
+        cur.execute(
+            f"""
+            SELECT m.entity_id, m.doc_id, m.page_no, c.chunk_no, m.chunk_id,
+                   m.start_char, m.end_char, {text_column}
+            FROM entity_mentions m
+            JOIN chunks c ON c.id = m.chunk_id
+            {doc_clause}
+            WINDOW chunk_rows AS (PARTITION BY m.chunk_id ORDER BY m.start_char, m.id)
+            ORDER BY m.doc_id, m.chunk_id, m.start_char, m.id
+            """,
+            (doc_ids,) if doc_ids is not None else None,
+        )
+
+        def rows() -> Iterator[Mention]:
+            offsets: list[int] = []
+            for entity_id, doc_id, page_no, chunk_no, chunk_id, start, end, text in cur:
+                start_token = end_token = None
+                if with_tokens:
+                    if text is not None:
+                        offsets = token_offsets(text)
+                    if start is not None and end is not None:
+                        start_token = token_index(offsets, start)
+                        end_token = token_index(offsets, max(start, end - 1))
+                yield Mention(
+                    str(entity_id),
+                    str(doc_id),
+                    page_no,
+                    chunk_no,
+                    str(chunk_id),
+                    start,
+                    end,
+                    start_token,
+                    end_token,
+                )
+
+        for doc_id, mentions in groupby(rows(), key=lambda mention: mention.doc_id):
+            yield doc_id, list(mentions)
+
+
+def reset_graph(cur) -> None:
+    cur.execute("TRUNCATE edge_evidence, edges, graph_doc_contributions")
+
+
+def last_watermark(cur) -> str | None:
+    cur.execute(
+        """
+        SELECT stats->>'watermark' FROM jobs
+        WHERE job_type = 'graph' AND status = 'done' AND stats ? 'watermark'
+        ORDER BY created_at DESC
+        LIMIT 1
+        """
+    )
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def next_watermark(cur) -> str:
+    # sync_watermark() (migration 0008): start of the oldest transaction still
+    # open elsewhere, shared with the Postgres-sourced search index.
+    cur.execute("SELECT sync_watermark()::text")
+    return cur.fetchone()[0]
+
+
+def changed_doc_ids(cur, since: str) -> list[str]:
+    # Documents whose mentions were added or replaced (NER writes
+    # chunk_ner_state.processed_at even when a chunk ends up with no
+    # mentions), whose chunks were reloaded, or that were deleted but still
+    # have contributions. >=: rows written by the transaction the watermark
+    # was taken from carry exactly its start time.
+    cur.execute(
+        """
+        SELECT doc_id FROM entity_mentions WHERE created_at >= %(since)s
+        UNION
+        SELECT c.doc_id FROM chunk_ner_state s
+        JOIN chunks c ON c.id = s.chunk_id
+        WHERE s.processed_at >= %(since)s
+        UNION
+        SELECT id FROM documents WHERE updated_at >= %(since)s
+        UNION
+        SELECT DISTINCT g.doc_id FROM graph_doc_contributions g
+        WHERE NOT EXISTS (SELECT 1 FROM documents d WHERE d.id = g.doc_id)
+        """,
+        {"since": since},
+    )
+    return [str(doc_id) for (doc_id,) in cur.fetchall()]
+
+
+def subtract_docs(cur, doc_ids: list[str]) -> None:
+    # Remove the documents' previous contributions from edge weights and drop
+    # their evidence; their current mentions are added back by write_delta.
+    cur.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS graph_touched_edges (
+          entity_a_id uuid NOT NULL,
+          entity_b_id uuid NOT NULL,
+          edge_type edge_type NOT NULL,
+          weight real NOT NULL
+        )
+        """
+    )
+    cur.execute("TRUNCATE graph_touched_edges")
+    cur.execute(
+        """
+        WITH removed AS (
+          DELETE FROM graph_doc_contributions
+          WHERE doc_id = ANY(%s::uuid[])
+          RETURNING entity_a_id, entity_b_id, edge_type, weight
+        )
+        INSERT INTO graph_touched_edges
+        SELECT entity_a_id, entity_b_id, edge_type, sum(weight)
+        FROM removed
+        GROUP BY entity_a_id, entity_b_id, edge_type
+        """,
+        (doc_ids,),
+    )
+    cur.execute(
+        """
+        UPDATE edges e SET weight = e.weight - t.weight
+        FROM graph_touched_edges t
+        WHERE e.entity_a_id = t.entity_a_id
+          AND e.entity_b_id = t.entity_b_id
+          AND e.edge_type = t.edge_type
+        """
+    )
+    cur.execute("DELETE FROM edge_evidence WHERE doc_id = ANY(%s::uuid[])", (doc_ids,))
+
+
+def drop_empty_edges(cur) -> int:
+    # Edges whose every contributing document went away.
+    cur.execute(
+        """
+        DELETE FROM edges e
+        USING graph_touched_edges t
+        WHERE e.entity_a_id = t.entity_a_id
+          AND e.entity_b_id = t.entity_b_id
+          AND e.edge_type = t.edge_type
+          AND e.weight <= 0
+        """
+    )
+    return cur.rowcount
+
+
+def write_delta(cur, delta: GraphDelta) -> int:
+    # COPY the aggregated weights into a temp table and merge them with one
+    # INSERT ... ON CONFLICT that adds to existing weights; evidence rows are
+    # then COPY'd against the returned edge ids.
+    if not delta:
+        return 0
+    cur.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS graph_edge_batch (
+          entity_a_id uuid NOT NULL,
+          entity_b_id uuid NOT NULL,
+          edge_type edge_type NOT NULL,
+          weight real NOT NULL
+        )
+        """
+    )
+    cur.execute("TRUNCATE graph_edge_batch")
+    with cur.copy(f"COPY graph_edge_batch ({', '.join(EDGE_COLUMNS)}) FROM STDIN") as copy:
+        for (a, b, edge_type), weight in delta.weights.items():
+            copy.write_row((a, b, edge_type, weight))
+
+    cur.execute(
+        """
+        INSERT INTO edges (entity_a_id, entity_b_id, edge_type, weight, first_seen_at, last_seen_at)
+        SELECT entity_a_id, entity_b_id, edge_type, weight, now(), now()
+        FROM graph_edge_batch
+        ON CONFLICT (entity_a_id, entity_b_id, edge_type)
+        DO UPDATE SET
+          weight = edges.weight + EXCLUDED.weight,
+          last_seen_at = EXCLUDED.last_seen_at
+        RETURNING id, entity_a_id, entity_b_id, edge_type::text
+        """
+    )
+    edge_ids = {(str(a), str(b), edge_type): str(edge_id) for edge_id, a, b, edge_type in cur}
+
+    with cur.copy(f"COPY edge_evidence ({', '.join(EVIDENCE_COLUMNS)}) FROM STDIN") as copy:
+        for key, rows in delta.evidence.items():
+            edge_id = edge_ids[key]
+            for row in rows:
+                copy.write_row(
+                    (
+                        edge_id,
+                        row.doc_id,
+                        row.page_no,
+                        row.chunk_id,
+                        row.start_char,
+                        row.end_char,
+                        row.score,
+                    )
+                )
+
+    with cur.copy(
+        f"COPY graph_doc_contributions ({', '.join(CONTRIBUTION_COLUMNS)}) FROM STDIN"
+    ) as copy:
+        for doc_id, (a, b, edge_type), weight in delta.contributions:
+            copy.write_row((doc_id, a, b, edge_type, weight))
+    return len(edge_ids)
+
+
+def record_job(cur, job_type: str, *, stats: dict) -> None:
+    from psycopg.types.json import Jsonb
+
+    cur.execute(
+        """
+        INSERT INTO jobs (job_type, status, started_at, ended_at, stats)
+        VALUES (%s, 'done', now(), clock_timestamp(), %s)
+        """,
+        (job_type, Jsonb(stats)),
+    )
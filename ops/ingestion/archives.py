@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import zipfile
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator
+from urllib.parse import quote, urlparse
+
+from state import Checkpoint, StateStore
+
+SPOOL_BLOCK = 1024 * 1024
+# Raised while reading a member that is encrypted, uses an unsupported
+# compression method or is corrupt.
+MEMBER_ERRORS = (zipfile.BadZipFile, RuntimeError, NotImplementedError, OSError, EOFError, zlib.error)
+# Local file header, or the end record of an empty archive.
+ZIP_MAGIC = (b"PK\x03\x04", b"PK\x05\x06")
+
+
+@dataclass
+class ArchiveStats:
+    archives: int = 0
+    members: int = 0
+    skipped: int = 0
+
+
+class ArchiveExpander:
+    # Expands downloaded ZIPs for the process command: PDF members are
+    # streamed out one at a time into spool_dir (named by sha256) and queued
+    # like downloaded PDFs under the pseudo-URL "<archive url>#<member>";
+    # other members are skipped.
+    def __init__(
+        self,
+        *,
+        store: StateStore,
+        checkpoint: Checkpoint,
+        spool_dir: Path,
+        force: bool = False,
+    ) -> None:
+        self.store = store
+        self.checkpoint = checkpoint
+        self.spool_dir = spool_dir
+        self.force = force
+        # member URL -> archive URL, and archive URL -> members not finished
+        # yet (+1 while it is still being read): an archive is only
+        # checkpointed once all of its members are, so an interrupted run
+        # re-reads it.
+        self.parents: dict[str, str] = {}
+        self.open_members: dict[str, int] = {}
+        # Spooled copies of members, deleted once their sha256 is processed.
+        self.spooled: dict[str, Path] = {}
+        self.stats = ArchiveStats()
+
+    def expand(
+        self,
+        url: str,
+        meta: dict,
+        file_path: Path,
+        *,
+        claim: Callable[[str, dict, str], bool],
+        unclaim: Callable[[str], None],
+    ) -> Iterator[tuple[str, Path]]:
+        # Yields (sha256, spooled path) for each member claim(member url,
+        # member meta, sha256) wants extracted; unclaim(sha256) withdraws a
+        # claim whose member could not be spooled after all. The archive's
+        # own meta is updated and stored once it has been read.
+        archive_url = meta.get("final_url") or url
+        self.open_members[url] = 1
+        pdf_members = 0
+        try:
+            with zipfile.ZipFile(file_path) as zf:
+                for info in iter_zip_members(zf):
+                    murl = member_url(url, info.filename)
+                    mmeta = self.store.get_url(murl) or {}
+                    fingerprint = member_fingerprint(info)
+                    sha256 = None
+                    if not self.force and mmeta.get("archive_fingerprint") == fingerprint:
+                        sha256 = mmeta.get("sha256")
+                    member_path = None
+                    if sha256 is None:
+                        try:
+                            spooled = spool_member(zf, info, self.spool_dir)
+                        except MEMBER_ERRORS as exc:
+                            self._member_error(url, murl, mmeta, info, str(exc))
+                            continue
+                        if spooled is None:
+                            continue
+                        sha256, member_path = spooled
+
+                    mmeta.update(
+                        {
+                            "final_url": member_url(archive_url, info.filename),
+                            "source_host": meta.get("source_host") or urlparse(archive_url).netloc,
+                            "file_type": "pdf",
+                            "sha256": sha256,
+                            "size": info.file_size,
+                            "archive_url": url,
+                            "archive_sha256": meta.get("sha256"),
+                            "archive_member": info.filename,
+                            "archive_fingerprint": fingerprint,
+                        }
+                    )
+                    for key in ("dataset", "published_date"):
+                        if meta.get(key) is not None:
+                            mmeta[key] = meta[key]
+                    self.store.put_url(murl, mmeta)
+                    self.store.setdefault_file(
+                        sha256, {"archive_url": url, "archive_member": info.filename}
+                    )
+                    self.parents[murl] = url
+                    self.open_members[url] += 1
+                    extract = claim(murl, mmeta, sha256)
+                    if extract and member_path is None:
+                        # Reused by fingerprint, but its output has to be
+                        # rebuilt after all.
+                        member_path, error = self._respool(zf, info)
+                        if member_path is None:
+                            unclaim(sha256)
+                            del self.parents[murl]
+                            self.open_members[url] -= 1
+                            self._member_error(url, murl, mmeta, info, error)
+                            continue
+                    pdf_members += 1
+                    self.stats.members += 1
+                    if extract:
+                        self.spooled[sha256] = member_path
+                        yield sha256, member_path
+                    elif member_path is not None and sha256 not in self.spooled:
+                        member_path.unlink(missing_ok=True)
+        except zipfile.BadZipFile as exc:
+            meta["process_error"] = f"bad_zip: {exc}"
+        else:
+            self.stats.archives += 1
+            meta.pop("process_error", None)
+            meta["archive_members"] = pdf_members
+        meta.pop("process_skip", None)
+        self.store.put_url(url, meta)
+        self._release(url)
+
+    def url_done(self, url: str) -> None:
+        # Checkpoints a finished URL, or counts a member off its archive.
+        archive_url = self.parents.pop(url, None)
+        if archive_url is None:
+            self.checkpoint.done(url)
+        else:
+            self._release(archive_url)
+
+    def processed(self, sha256: str) -> None:
+        if sha256 in self.spooled:
+            self.spooled.pop(sha256).unlink(missing_ok=True)
+
+    def _release(self, archive_url: str) -> None:
+        self.open_members[archive_url] -= 1
+        if not self.open_members[archive_url]:
+            del self.open_members[archive_url]
+            self.checkpoint.done(archive_url)
+
+    def _respool(self, zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> tuple[Path | None, str]:
+        try:
+            spooled = spool_member(zf, info, self.spool_dir)
+        except MEMBER_ERRORS as exc:
+            return None, str(exc)
+        if spooled is None:
+            return None, "no longer a PDF"
+        return spooled[1], ""
+
+    def _member_error(
+        self, url: str, murl: str, mmeta: dict, info: zipfile.ZipInfo, error: str
+    ) -> None:
+        mmeta.update({"archive_url": url, "archive_member": info.filename, "process_error": error})
+        self.store.put_url(murl, mmeta)
+        self.stats.skipped += 1
+
+
+def is_zip_file(path: Path) -> bool:
+    # Checks the leading magic; zipfile.is_zipfile scans the tail, which also
+    # matches PDFs with an appended or embedded ZIP.
+    try:
+        with path.open("rb") as handle:
+            return handle.read(4) in ZIP_MAGIC
+    except OSError:
+        return False
+
+
+def iter_zip_members(zf: zipfile.ZipFile) -> Iterator[zipfile.ZipInfo]:
+    # Entries in archive order; the central directory is read once and
+    # nothing is decompressed until a member is spooled.
+    for info in zf.infolist():
+        if not info.is_dir():
+            yield info
+
+
+def member_url(archive_url: str, name: str) -> str:
+    return f"{archive_url}#{quote(name, safe='/')}"
+
+
+def member_fingerprint(info: zipfile.ZipInfo) -> str:
+    # Stored with the member's state entry: an unchanged CRC and size lets a
+    # re-run reuse the recorded sha256 without decompressing the member again.
+    return f"{info.CRC:08x}:{info.file_size}"
+
+
+def spool_member(
+    zf: zipfile.ZipFile, info: zipfile.ZipInfo, spool_dir: Path
+) -> tuple[str, Path] | None:
+    # Streams one member to spool_dir/<sha256>.pdf in SPOOL_BLOCK pieces,
+    # hashing as it goes; members that are not PDFs are dropped after their
+    # first block. Returns (sha256, path) or None.
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = spool_dir / f".member-{os.getpid()}.part"
+    digest = hashlib.sha256()
+    try:
+        with zf.open(info) as source, tmp_path.open("wb") as handle:
+            block = source.read(SPOOL_BLOCK)
+            if not block.lstrip()[:5].startswith(b"%PDF"):
+                return None
+            while block:
+                digest.update(block)
+                handle.write(block)
+                block = source.read(SPOOL_BLOCK)
+        sha256 = digest.hexdigest()
+        path = spool_dir / f"{sha256}.pdf"
+        os.replace(tmp_path, path)
+        return sha256, path
+    finally:
+        tmp_path.unlink(missing_ok=True)
@@ -3,6 +3,8 @@ from __future__ import annotations
 from dataclasses import dataclass
 from typing import Iterable
 
+CHUNKER_VERSION = 2
+
 
 @dataclass
 class Chunk:
@@ -14,27 +16,28 @@ class Chunk:
 
 
 def chunk_page_text(page_no: int, text: str) -> list[Chunk]:
+    # start_char/end_char are offsets into the page text: text[start:end] is
+    # the stripped paragraph.
     chunks: list[Chunk] = []
-    paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
-    if not paragraphs:
-        return chunks
-
     cursor = 0
     chunk_no = 0
-    for para in paragraphs:
+    for segment in text.split("\n\n"):
+        segment_start = cursor
+        cursor += len(segment) + 2
+        para = segment.strip()
+        if not para:
+            continue
         chunk_no += 1
-        start = cursor
-        end = start + len(para)
+        start = segment_start + len(segment) - len(segment.lstrip())
         chunks.append(
             Chunk(
                 page_no=page_no,
                 chunk_no=chunk_no,
                 text=para,
                 start_char=start,
-                end_char=end,
+                end_char=start + len(para),
             )
         )
-        cursor = end + 2
 
     return chunks
 
@@ -2,86 +2,230 @@
 import argparse
 import json
 import os
+import time
 from pathlib import Path
 
+from archives import ArchiveExpander, is_zip_file
 from crawler import crawl_listing_pages
 from downloader import download_all
-from process import process_pdf
-from state import load_state, save_state
+from http_client import HttpClient
+from ocr import OcrConfig, tesseract_available
+from process import file_sha256, is_current_output, pipeline_version, process_many
+from processed_io import COMPRESSION_SUFFIXES
+from state import Checkpoint, open_state
+
+
+DEFAULT_STATE_PATH = str(Path("ops/ingestion/state/state.sqlite3"))
+STATE_HELP = "State database path (a legacy state.json alongside it is migrated on first use)"
 
 
 def cmd_crawl(args: argparse.Namespace) -> None:
     seeds = read_seeds_file(Path(args.seeds))
-    urls = crawl_listing_pages(
-        seeds=seeds,
-        allowed_hosts=set(args.allowed_host),
-        blocked_path_substrings=set(args.blocked_path_substring),
-        allowed_extensions=set(args.allowed_ext),
-        rate_limit_seconds=args.rate_limit_seconds,
-        user_agent=args.user_agent,
-    )
+    with open_state(Path(args.state)) as store, make_client(args) as client:
+        result = crawl_listing_pages(
+            seeds=seeds,
+            allowed_hosts=set(args.allowed_host),
+            blocked_path_substrings=set(args.blocked_path_substring),
+            allowed_extensions=set(args.allowed_ext),
+            rate_limit_seconds=args.rate_limit_seconds,
+            client=client,
+            store=store,
+            max_depth=args.max_depth,
+            max_pages=args.max_pages,
+            concurrency=args.concurrency,
+        )
     output_path = Path(args.output)
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    output_path.write_text(json.dumps(sorted(urls), indent=2), encoding="utf-8")
-    print(f"Wrote {len(urls)} URLs to {output_path}")
+    write_json_atomic(output_path, sorted(result.urls))
+    print(
+        f"Wrote {len(result.urls)} URLs to {output_path} "
+        f"({result.pages} listing pages fetched, {result.unchanged} unchanged, "
+        f"{result.failed} failed)"
+    )
 
 
 def cmd_download(args: argparse.Namespace) -> None:
     input_path = Path(args.input)
     urls = json.loads(input_path.read_text(encoding="utf-8"))
 
-    state_path = Path(args.state)
-    state = load_state(state_path)
-
     download_dir = Path(args.download_dir)
     download_dir.mkdir(parents=True, exist_ok=True)
 
-    updated_state = download_all(
-        urls=urls,
-        state=state,
-        download_dir=download_dir,
-        rate_limit_seconds=args.rate_limit_seconds,
-        user_agent=args.user_agent,
-    )
-
-    save_state(state_path, updated_state)
-    print(f"Updated state at {state_path}")
+    with open_state(Path(args.state)) as store, make_client(args) as client:
+        checkpoint = make_checkpoint(store, "download", args)
+        remaining = checkpoint.remaining(urls)
+        if checkpoint.resumed:
+            print(f"Resuming download run: {len(urls) - len(remaining)} URLs already done")
+        completed = download_all(
+            urls=remaining,
+            store=store,
+            download_dir=download_dir,
+            rate_limit_seconds=args.rate_limit_seconds,
+            client=client,
+            checkpoint=checkpoint,
+            concurrency=args.concurrency,
+        )
+        checkpoint.finish()
+    print(f"Checked {completed} URLs; state at {store.path}")
 
 
 def cmd_process(args: argparse.Namespace) -> None:
     input_path = Path(args.input)
     urls = json.loads(input_path.read_text(encoding="utf-8"))
-    state_path = Path(args.state)
-    state = load_state(state_path)
 
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
+    spool_dir = Path(args.zip_spool_dir)
+
+    ocr = None
+    if args.ocr:
+        if not tesseract_available():
+            raise SystemExit("--ocr requires the tesseract binary on PATH")
+        ocr = OcrConfig(
+            cache_dir=Path(args.ocr_cache_dir),
+            threshold=args.ocr_threshold,
+            dpi=args.ocr_dpi,
+            lang=args.ocr_lang,
+        )
+    version = pipeline_version(ocr)
+
+    store = open_state(Path(args.state))
+    checkpoint = make_checkpoint(store, "process", args)
+    remaining = checkpoint.remaining(urls)
+    if checkpoint.resumed:
+        print(f"Resuming process run: {len(urls) - len(remaining)} URLs already done")
 
     processed = 0
+    reused = 0
     skipped = 0
-    for url in urls:
-        meta = state.get("url_meta", {}).get(url)
-        if not meta:
-            continue
-        file_path = Path(meta["path"])
-        if not file_path.exists():
-            continue
-        if not is_pdf_file(file_path):
-            meta["process_skip"] = "non_pdf"
-            skipped += 1
-            continue
-        try:
-            result = process_pdf(file_path, output_dir)
-        except Exception as exc:  # pragma: no cover - runtime safety
-            meta["process_error"] = str(exc)
-            skipped += 1
-            continue
-        meta["processed_output"] = result["output"]
-        meta["chunk_count"] = result["chunks"]
-        processed += 1
+    # sha256 -> URLs waiting on it, so a file reached via several URLs is
+    # extracted once.
+    waiting: dict[str, list[str]] = {}
+    expander = ArchiveExpander(
+        store=store, checkpoint=checkpoint, spool_dir=spool_dir, force=args.force
+    )
 
-    save_state(state_path, state)
-    print(f"Processed {processed} files (skipped {skipped})")
+    def needs_extraction(url: str, meta: dict, sha256: str) -> bool:
+        nonlocal reused
+        if sha256 in waiting:
+            waiting[sha256].append(url)
+            return False
+        file_meta = store.get_file(sha256)
+        if not args.force and is_current_output(file_meta, version):
+            apply_process_result(meta, file_meta)
+            store.put_url(url, meta)
+            expander.url_done(url)
+            reused += 1
+            return False
+        waiting[sha256] = [url]
+        return True
+
+    def pending_pdfs():
+        nonlocal skipped
+        for url in remaining:
+            meta = store.get_url(url)
+            if not meta or not meta.get("path"):
+                checkpoint.done(url)
+                continue
+            file_path = Path(meta["path"])
+            if not file_path.exists():
+                checkpoint.done(url)
+                continue
+            if is_zip_file(file_path):
+                for sha256, member_path in expander.expand(
+                    url, meta, file_path, claim=needs_extraction, unclaim=waiting.pop
+                ):
+                    yield sha256, member_path, sha256
+                continue
+            if not is_pdf_file(file_path):
+                meta["process_skip"] = "non_pdf"
+                store.put_url(url, meta)
+                checkpoint.done(url)
+                skipped += 1
+                continue
+
+            sha256 = meta.get("sha256") or file_sha256(file_path)
+            if needs_extraction(url, meta, sha256):
+                yield sha256, file_path, sha256
+
+    for sha256, result, error in process_many(
+        pending_pdfs(),
+        output_dir,
+        workers=args.workers,
+        compression=args.output_compression,
+        ocr=ocr,
+    ):
+        if error is None:
+            file_meta = store.get_file(sha256) or {}
+            file_meta["processed_output"] = result["output"]
+            file_meta["chunk_count"] = result["chunks"]
+            file_meta["pipeline_version"] = result["pipeline_version"]
+            file_meta["ocr_quality"] = result["ocr_quality"]
+            store.put_file(sha256, file_meta)
+        expander.processed(sha256)
+        for url in waiting.pop(sha256):
+            meta = store.get_url(url)
+            if error is not None:
+                meta["process_error"] = error
+                skipped += 1
+            else:
+                apply_process_result(meta, file_meta)
+                processed += 1
+            store.put_url(url, meta)
+            expander.url_done(url)
+
+    checkpoint.finish()
+    store.close()
+    print(
+        f"Processed {processed} files "
+        f"(reused {reused} unchanged outputs, skipped {skipped + expander.stats.skipped}; "
+        f"{expander.stats.members} PDFs from {expander.stats.archives} ZIP archives)"
+    )
+
+
+def apply_process_result(meta: dict, file_meta: dict) -> None:
+    meta.pop("process_error", None)
+    meta["processed_output"] = file_meta["processed_output"]
+    meta["chunk_count"] = file_meta["chunk_count"]
+    meta["pipeline_version"] = file_meta["pipeline_version"]
+    meta["ocr_quality"] = file_meta.get("ocr_quality")
+
+
+def make_checkpoint(store, command: str, args: argparse.Namespace) -> Checkpoint:
+    return Checkpoint(
+        store,
+        command,
+        input_key=str(Path(args.input).resolve()),
+        every_items=args.checkpoint_every,
+        every_seconds=args.checkpoint_seconds,
+        fresh=args.fresh,
+    )
+
+
+def write_json_atomic(path: Path, payload) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def add_checkpoint_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=100,
+        help="Commit state after this many items",
+    )
+    parser.add_argument(
+        "--checkpoint-seconds",
+        type=float,
+        default=30.0,
+        help="Commit state at least this often (seconds)",
+    )
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help="Ignore an interrupted run and start from the first URL",
+    )
 
 
 def is_pdf_file(path: Path) -> bool:
@@ -102,13 +246,19 @@ def cmd_load_db(args: argparse.Namespace) -> None:
 
     from db_writer import load_processed_into_db
 
-    state_path = Path(args.state)
-    inserted = load_processed_into_db(
-        database_url=database_url,
-        state_path=state_path,
-        max_docs=args.max_docs,
+    with open_state(Path(args.state)) as store:
+        stats = load_processed_into_db(
+            database_url=database_url,
+            store=store,
+            max_docs=args.max_docs,
+            batch_docs=args.batch_docs,
+            force=args.force,
+        )
+    print(
+        f"Loaded {stats.documents} documents into Postgres "
+        f"({stats.unchanged_documents} unchanged; chunks: {stats.chunks_inserted} inserted, "
+        f"{stats.chunks_updated} updated, {stats.chunks_deleted} deleted)"
     )
-    print(f"Loaded {inserted} documents into Postgres")
 
 
 def cmd_index(args: argparse.Namespace) -> None:
@@ -116,29 +266,74 @@ def cmd_index(args: argparse.Namespace) -> None:
     meili_key = args.meili_master_key or os.environ.get("MEILI_MASTER_KEY", "")
     if not meili_host or not meili_key:
         raise SystemExit("MEILI_HOST and MEILI_MASTER_KEY are required")
+    database_url = args.database_url or os.environ.get("DATABASE_URL", "")
+    # Both sources write the same search ids but keep separate sync state, so
+    # with a database configured Postgres is the source by default: processed
+    # records carry no entities and would overwrite the enriched ones.
+    source = args.source or ("postgres" if database_url else "processed")
+    if source == "postgres" and not database_url:
+        raise SystemExit("DATABASE_URL is required for --source postgres (or pass --database-url)")
+
+    from indexer import IndexPipeline, MeiliIndexer, MeiliTaskError, sync_index
+
+    client = make_client(args)
+    indexer = MeiliIndexer(meili_host, meili_key, client)
+    pipeline = IndexPipeline(
+        indexer,
+        uploaders=args.uploaders,
+        max_pending_tasks=args.max_pending_tasks,
+        compress=args.gzip,
+    )
 
-    from indexer import MeiliIndexer, build_chunk_records, load_processed_outputs
-
-    state_path = Path(args.state)
-    state = load_state(state_path)
-    indexer = MeiliIndexer(meili_host, meili_key)
+    started = time.perf_counter()
+    try:
+        if source == "postgres":
+            from db_index import sync_index_from_db
+
+            stats = sync_index_from_db(
+                database_url=database_url,
+                pipeline=pipeline,
+                batch_chunks=args.batch_chunks,
+                batch_bytes=args.batch_bytes,
+                force=args.force,
+            )
+        else:
+            with open_state(Path(args.state)) as store:
+                stats = sync_index(
+                    store=store,
+                    pipeline=pipeline,
+                    max_docs=args.max_docs,
+                    batch_bytes=args.batch_bytes,
+                    force=args.force,
+                )
+    except MeiliTaskError as exc:
+        raise SystemExit(str(exc)) from exc
+    finally:
+        client.close()
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"Indexed {stats.documents} documents into Meilisearch ({stats.unchanged_documents} "
+        f"unchanged; chunks: {stats.records} upserted, {stats.deleted} deleted) in "
+        f"{stats.batches} batches ({stats.bytes / 1024 / 1024:.1f} MiB, {stats.tasks} tasks) "
+        f"in {elapsed:.1f}s"
+    )
 
-    batch: list[dict] = []
-    total = 0
-    for url, payload in load_processed_outputs(state_path=state_path, max_docs=args.max_docs):
-        meta = state.get("url_meta", {}).get(url, {})
-        chunks = build_chunk_records(url=url, meta=meta, payload=payload)
-        batch.extend(chunks)
-        total += len(chunks)
 
-        if len(batch) >= args.batch_size:
-            indexer.upsert_chunks(batch)
-            batch = []
+def make_client(args: argparse.Namespace) -> HttpClient:
+    return HttpClient(
+        user_agent=args.user_agent,
+        timeout=args.http_timeout,
+        max_attempts=args.max_attempts,
+    )
 
-    if batch:
-        indexer.upsert_chunks(batch)
 
-    print(f"Indexed {total} chunks into Meilisearch")
+def cmd_export_state(args: argparse.Namespace) -> None:
+    output_path = Path(args.output)
+    with open_state(Path(args.state)) as store:
+        store.export_json(output_path)
+        count = store.count_urls()
+    print(f"Exported {count} URLs to {output_path}")
 
 
 def read_seeds_file(path: Path) -> list[str]:
@@ -165,7 +360,19 @@ def build_parser() -> argparse.ArgumentParser:
         "--rate-limit-seconds",
         type=float,
         default=1.0,
-        help="Minimum delay between HTTP requests",
+        help="Minimum delay between HTTP requests to the same host",
+    )
+    parser.add_argument(
+        "--http-timeout",
+        type=float,
+        default=30.0,
+        help="Socket timeout for HTTP requests (seconds)",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=5,
+        help="Max attempts per HTTP request (exponential backoff with jitter)",
     )
 
     sub = parser.add_subparsers(dest="command", required=True)
@@ -199,6 +406,29 @@ def build_parser() -> argparse.ArgumentParser:
         default=[".pdf", ".zip"],
         help="Allowed file extension (repeatable)",
     )
+    crawl.add_argument(
+        "--state",
+        default=DEFAULT_STATE_PATH,
+        help=STATE_HELP,
+    )
+    crawl.add_argument(
+        "--max-depth",
+        type=int,
+        default=2,
+        help="Follow listing links this many levels below the seeds (pagination stays at its level)",
+    )
+    crawl.add_argument(
+        "--max-pages",
+        type=int,
+        default=1000,
+        help="Stop queueing listing pages after this many",
+    )
+    crawl.add_argument(
+        "--concurrency",
+        type=int,
+        default=2,
+        help="Number of concurrent page fetches (politeness is still per-host rate limited)",
+    )
     crawl.set_defaults(func=cmd_crawl)
 
     download = sub.add_parser("download", help="Download and hash files")
@@ -209,18 +439,25 @@ def build_parser() -> argparse.ArgumentParser:
     )
     download.add_argument(
         "--state",
-        default=str(Path("ops/ingestion/state/state.json")),
-        help="State JSON path",
+        default=DEFAULT_STATE_PATH,
+        help=STATE_HELP,
     )
     download.add_argument(
         "--download-dir",
         default=str(Path("ops/ingestion/state/downloads")),
         help="Directory to store downloaded files",
     )
+    download.add_argument(
+        "--concurrency",
+        type=int,
+        default=2,
+        help="Number of concurrent downloads (politeness is still per-host rate limited)",
+    )
+    add_checkpoint_arguments(download)
     download.set_defaults(func=cmd_download)
 
     process = sub.add_parser(
-        "process", help="Extract text and chunk PDFs into JSON outputs"
+        "process", help="Extract text and chunk PDFs into NDJSON outputs"
     )
     process.add_argument(
         "--input",
@@ -229,14 +466,64 @@ def build_parser() -> argparse.ArgumentParser:
     )
     process.add_argument(
         "--state",
-        default=str(Path("ops/ingestion/state/state.json")),
-        help="State JSON path",
+        default=DEFAULT_STATE_PATH,
+        help=STATE_HELP,
     )
     process.add_argument(
         "--output-dir",
         default=str(Path("ops/ingestion/state/processed")),
-        help="Directory to store processed JSON outputs",
+        help="Directory to store processed NDJSON outputs",
+    )
+    process.add_argument(
+        "--output-compression",
+        choices=sorted(COMPRESSION_SUFFIXES),
+        default="gzip",
+        help="Compression for NDJSON processed outputs (zstd needs the zstandard package)",
+    )
+    process.add_argument(
+        "--ocr",
+        action="store_true",
+        help="OCR pages whose text layer is empty or below --ocr-threshold (needs tesseract)",
+    )
+    process.add_argument(
+        "--ocr-threshold",
+        type=float,
+        default=0.5,
+        help="Text quality score (0..1) below which a page is OCR'd",
+    )
+    process.add_argument(
+        "--ocr-dpi",
+        type=int,
+        default=300,
+        help="Render resolution for OCR",
     )
+    process.add_argument(
+        "--ocr-lang",
+        default="eng",
+        help="Tesseract language(s)",
+    )
+    process.add_argument(
+        "--ocr-cache-dir",
+        default=str(Path("ops/ingestion/state/ocr_cache")),
+        help="OCR results cache, keyed by rendered page image sha256",
+    )
+    process.add_argument(
+        "--zip-spool-dir",
+        default=str(Path("ops/ingestion/state/zip_spool")),
+        help="Scratch directory for PDFs streamed out of ZIP archives while they are processed",
+    )
+    process.add_argument(
+        "--force",
+        action="store_true",
+        help="Re-extract files even if a current output exists for their sha256",
+    )
+    process.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Extraction worker processes (large PDFs are split by page range)",
+    )
+    add_checkpoint_arguments(process)
     process.set_defaults(func=cmd_process)
 
     load_db = sub.add_parser(
@@ -244,8 +531,8 @@ def build_parser() -> argparse.ArgumentParser:
     )
     load_db.add_argument(
         "--state",
-        default=str(Path("ops/ingestion/state/state.json")),
-        help="State JSON path",
+        default=DEFAULT_STATE_PATH,
+        help=STATE_HELP,
     )
     load_db.add_argument(
         "--database-url",
@@ -258,6 +545,17 @@ def build_parser() -> argparse.ArgumentParser:
         default=None,
         help="Optional limit on number of documents to load",
     )
+    load_db.add_argument(
+        "--batch-docs",
+        type=int,
+        default=200,
+        help="Documents per COPY + merge transaction",
+    )
+    load_db.add_argument(
+        "--force",
+        action="store_true",
+        help="Reload documents already loaded from their current processed output",
+    )
     load_db.set_defaults(func=cmd_load_db)
 
     index = sub.add_parser(
@@ -265,8 +563,28 @@ def build_parser() -> argparse.ArgumentParser:
     )
     index.add_argument(
         "--state",
-        default=str(Path("ops/ingestion/state/state.json")),
-        help="State JSON path",
+        default=DEFAULT_STATE_PATH,
+        help=STATE_HELP,
+    )
+    index.add_argument(
+        "--source",
+        choices=["processed", "postgres"],
+        default=None,
+        help=(
+            "Build records from processed outputs, or from Postgres with entities attached "
+            "(defaults to postgres when a database URL is set, else processed)"
+        ),
+    )
+    index.add_argument(
+        "--database-url",
+        default="",
+        help="Postgres connection string for --source postgres (defaults to DATABASE_URL env var)",
+    )
+    index.add_argument(
+        "--batch-chunks",
+        type=int,
+        default=1000,
+        help="Chunks read from Postgres per query (--source postgres)",
     )
     index.add_argument(
         "--meili-host",
@@ -285,13 +603,50 @@ def build_parser() -> argparse.ArgumentParser:
         help="Optional limit on number of documents to index",
     )
     index.add_argument(
-        "--batch-size",
+        "--batch-bytes",
+        type=int,
+        default=10 * 1024 * 1024,
+        help="Max JSON payload size per indexing request, in bytes",
+    )
+    index.add_argument(
+        "--uploaders",
+        type=int,
+        default=4,
+        help="Concurrent indexing requests",
+    )
+    index.add_argument(
+        "--max-pending-tasks",
         type=int,
-        default=500,
-        help="Chunk batch size for indexing",
+        default=8,
+        help="Wait for Meilisearch tasks to finish once this many are queued",
+    )
+    index.add_argument(
+        "--gzip",
+        action="store_true",
+        help="Send gzip-compressed request bodies",
+    )
+    index.add_argument(
+        "--force",
+        action="store_true",
+        help="Resend every chunk, not only new or changed ones",
     )
     index.set_defaults(func=cmd_index)
 
+    export_state = sub.add_parser(
+        "export-state", help="Dump the state database as JSON for inspection"
+    )
+    export_state.add_argument(
+        "--state",
+        default=DEFAULT_STATE_PATH,
+        help=STATE_HELP,
+    )
+    export_state.add_argument(
+        "--output",
+        default=str(Path("ops/ingestion/state/state.export.json")),
+        help="Output JSON path",
+    )
+    export_state.set_defaults(func=cmd_export_state)
+
     return parser
 
 
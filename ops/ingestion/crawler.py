@@ -1,9 +1,16 @@
-import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from html.parser import HTMLParser
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urldefrag, urljoin, urlparse
 
-from http_client import fetch_url
-from rate_limiter import RateLimiter
+from downloader import conditional_headers
+from http_client import HttpClient, HttpError, HttpResponse
+from rate_limiter import HostRateLimiter
+from state import StateStore
+
+# Listing pages have no extension in their last path segment, or one of these.
+LISTING_SUFFIXES = (".htm", ".html", ".aspx", ".php")
 
 
 class LinkExtractor(HTMLParser):
@@ -25,6 +32,14 @@ class LinkExtractor(HTMLParser):
         self.links.add(urljoin(self.base_url, href))
 
 
+@dataclass
+class CrawlResult:
+    urls: set[str] = field(default_factory=set)
+    pages: int = 0
+    unchanged: int = 0
+    failed: int = 0
+
+
 def crawl_listing_pages(
     *,
     seeds: list[str],
@@ -32,30 +47,131 @@ def crawl_listing_pages(
     blocked_path_substrings: set[str],
     allowed_extensions: set[str],
     rate_limit_seconds: float,
-    user_agent: str,
-) -> set[str]:
-    limiter = RateLimiter(rate_limit_seconds)
-    found: set[str] = set()
+    client: HttpClient,
+    store: StateStore | None = None,
+    max_depth: int = 2,
+    max_pages: int = 1000,
+    concurrency: int = 2,
+) -> CrawlResult:
+    # Frontier crawl from the seeds. File links (allowed_extensions) are
+    # collected; in-scope HTML links (same host rules, under a seed's
+    # directory) are crawled as listing pages. Pagination of the page being
+    # read (same path, different query) stays at its depth, any other listing
+    # link is one level deeper, up to max_depth. Pages are fetched by
+    # `concurrency` threads behind a per-host rate limit. With a store, each
+    # page's ETag/Last-Modified and links are kept in listing_pages: a 304
+    # reuses the stored links, and a failed fetch falls back to them.
+    limiter = HostRateLimiter(rate_limit_seconds)
+    result = CrawlResult()
+    scopes = {listing_scope(seed) for seed in seeds}
+    seen: set[str] = set()
+    frontier: deque[tuple[str, int]] = deque()
+
+    def enqueue(url: str, depth: int) -> None:
+        url, _ = urldefrag(url)
+        if url not in seen and depth <= max_depth and len(seen) < max_pages:
+            seen.add(url)
+            frontier.append((url, depth))
 
     for seed in seeds:
-        limiter.wait()
-        result = fetch_url(seed, user_agent=user_agent)
-        if result is None:
-            continue
-        html_bytes = result[0]
-        final_url = result[1]
-        extractor = LinkExtractor(final_url)
-        extractor.feed(html_bytes.decode("utf-8", errors="ignore"))
-        links = filter_links(
-            extractor.links,
-            allowed_hosts=allowed_hosts,
-            blocked_path_substrings=blocked_path_substrings,
-            allowed_extensions=allowed_extensions,
-        )
-        found.update(links)
-        time.sleep(0.01)
-
-    return found
+        enqueue(seed, 0)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        in_flight: dict = {}
+        while frontier or in_flight:
+            while frontier and len(in_flight) < max(1, concurrency) * 2:
+                url, depth = frontier.popleft()
+                cached = store.get_listing_page(url) if store is not None else None
+                future = pool.submit(
+                    fetch_listing_page,
+                    url,
+                    headers=conditional_headers(cached),
+                    limiter=limiter,
+                    client=client,
+                )
+                in_flight[future] = (url, depth, cached)
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                url, depth, cached = in_flight.pop(future)
+                outcome = future.result()
+                if isinstance(outcome, HttpError):
+                    print(f"Skipping listing page {url}: {outcome}")
+                    result.failed += 1
+                    page = cached
+                elif outcome.status == 304 and cached:
+                    result.unchanged += 1
+                    page = cached
+                else:
+                    result.pages += 1
+                    extractor = LinkExtractor(outcome.final_url)
+                    extractor.feed(outcome.body.decode("utf-8", errors="ignore"))
+                    page = {
+                        "final_url": outcome.final_url,
+                        "etag": outcome.headers.get("etag"),
+                        "last_modified": outcome.headers.get("last-modified"),
+                        "files": sorted(
+                            filter_links(
+                                extractor.links,
+                                allowed_hosts=allowed_hosts,
+                                blocked_path_substrings=blocked_path_substrings,
+                                allowed_extensions=allowed_extensions,
+                            )
+                        ),
+                        "listings": sorted(
+                            link
+                            for link in filter_links(
+                                extractor.links,
+                                allowed_hosts=allowed_hosts,
+                                blocked_path_substrings=blocked_path_substrings,
+                                allowed_extensions=set(),
+                            )
+                            if is_listing_link(link, scopes)
+                        ),
+                    }
+                    if store is not None:
+                        store.put_listing_page(url, page)
+                if not page:
+                    continue
+
+                result.urls.update(page["files"])
+                page_path = urlparse(page.get("final_url") or url).path
+                for link in page["listings"]:
+                    paginated = urlparse(link).path == page_path
+                    enqueue(link, depth if paginated else depth + 1)
+            if store is not None:
+                store.commit()
+
+    return result
+
+
+def fetch_listing_page(
+    url: str,
+    *,
+    headers: dict[str, str],
+    limiter: HostRateLimiter,
+    client: HttpClient,
+) -> HttpResponse | HttpError:
+    limiter.wait(url)
+    try:
+        return client.fetch(url, extra_headers=headers)
+    except HttpError as exc:
+        return exc
+
+
+def is_listing_link(link: str, scopes: set[str]) -> bool:
+    path = urlparse(link).path or "/"
+    name = path.rsplit("/", 1)[-1].lower()
+    if "." in name and not name.endswith(LISTING_SUFFIXES):
+        return False
+    return any(path.startswith(scope) for scope in scopes)
+
+
+def listing_scope(seed: str) -> str:
+    # Listing links must stay under the seed's directory:
+    # https://www.justice.gov/epstein/doj-disclosures -> /epstein/
+    path = urlparse(seed).path or "/"
+    return path[: path.rfind("/") + 1]
 
 
 def filter_links(
@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+from typing import Callable, Iterator
+
+from indexer import (
+    DEFAULT_BATCH_BYTES,
+    IndexPipeline,
+    IndexStats,
+    iter_payloads,
+    meili_chunk_id,
+    record_fingerprint,
+)
+
+
+def sync_index_from_db(
+    *,
+    database_url: str,
+    pipeline: IndexPipeline,
+    batch_chunks: int = 1000,
+    batch_bytes: int = DEFAULT_BATCH_BYTES,
+    force: bool = False,
+) -> IndexStats:
+    # Search records built from Postgres, with each chunk's entities attached.
+    # chunk_index_state (migration 0007) records the fingerprint each chunk
+    # was indexed with; only chunks that are new, whose document was reloaded
+    # or whose mentions were rewritten (chunk_ner_state.processed_at) since
+    # then are rebuilt, and only those whose record actually changed are sent.
+    # Chunks deleted from Postgres are deleted from Meilisearch afterwards.
+    try:
+        import psycopg
+    except ModuleNotFoundError as exc:  # pragma: no cover - runtime dependency
+        raise ModuleNotFoundError(
+            "psycopg is required. Install with: pip install -r ops/requirements.txt"
+        ) from exc
+
+    stats = pipeline.stats
+    # Search ids replaced by a chunk's new one (its document's sha256 changed).
+    replaced: list[str] = []
+
+    with psycopg.connect(database_url, autocommit=True) as conn:
+        with conn.cursor() as cur:
+            # Same watermark as the graph refresh (migration 0008).
+            cur.execute("SELECT sync_watermark()::text")
+            indexed_at = cur.fetchone()[0]
+
+        def indexed(rows: list[tuple[str, str, str]]) -> Callable[[], None]:
+            def done() -> None:
+                with conn.cursor() as cur:
+                    record_indexed(cur, rows, indexed_at=indexed_at)
+
+            return done
+
+        def changed_records() -> Iterator[tuple[dict, tuple[str, str, str]]]:
+            docs: set[str] = set()
+            for page in iter_pending_chunks(conn, force=force, page_size=batch_chunks):
+                unchanged = []
+                for chunk_id, record, old_meili_id, old_fingerprint in page:
+                    docs.add(record["doc_id"])
+                    fingerprint = record_fingerprint(record)
+                    row = (chunk_id, record["chunk_id"], fingerprint)
+                    if old_meili_id is not None and old_meili_id != record["chunk_id"]:
+                        replaced.append(old_meili_id)
+                    if not force and fingerprint == old_fingerprint:
+                        unchanged.append(row)
+                    else:
+                        yield record, row
+                if unchanged:
+                    indexed(unchanged)()
+            stats.documents = len(docs)
+
+        for payload, rows in iter_payloads(changed_records(), max_bytes=batch_bytes):
+            pipeline.submit(payload, records=len(rows), on_success=indexed(rows))
+        if not pipeline.drain():
+            return pipeline.finish()  # raises MeiliTaskError
+
+        with conn.cursor() as cur:
+            deletes = []
+            for meili_id, chunk_ids, live in stale_search_ids(cur, replaced):
+                if live:
+                    # Another chunk (same file under another URL) still has it.
+                    forget_chunks(cur, chunk_ids)
+                else:
+                    deletes.append((meili_id, chunk_ids))
+
+        def forgotten(chunk_ids: list[str]) -> Callable[[], None]:
+            def done() -> None:
+                with conn.cursor() as cur:
+                    forget_chunks(cur, chunk_ids)
+
+            return done
+
+        for payload, groups in iter_payloads(deletes, max_bytes=batch_bytes):
+            chunk_ids = [chunk_id for group in groups for chunk_id in group]
+            pipeline.submit(
+                payload, records=len(groups), delete=True, on_success=forgotten(chunk_ids)
+            )
+        return pipeline.finish()
+
+
+def iter_pending_chunks(
+    conn, *, force: bool = False, page_size: int = 1000
+) -> Iterator[list[tuple[str, dict, str | None, str | None]]]:
+    # Keyset pages of (chunk id, search record, indexed search id, indexed
+    # fingerprint). Entities are attached with one aggregation per page.
+    # Timestamps are compared with >=: indexed_at can be the start of a
+    # transaction that was still open, and its rows carry exactly that time.
+    after = ("00000000-0000-0000-0000-000000000000", -1, -1)
+    while True:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT c.id, c.doc_id, c.page_no, c.chunk_no, c.text,
+                       d.file_sha256, d.source_url, d.source_host, d.dataset,
+                       d.published_date, d.title, s.meili_id, s.fingerprint
+                FROM chunks c
+                JOIN documents d ON d.id = c.doc_id
+                LEFT JOIN chunk_index_state s ON s.chunk_id = c.id
+                LEFT JOIN chunk_ner_state n ON n.chunk_id = c.id
+                WHERE (c.doc_id, c.page_no, c.chunk_no) > (%s::uuid, %s, %s)
+                  AND (%s OR s.chunk_id IS NULL
+                       OR d.updated_at >= s.indexed_at
+                       OR c.created_at >= s.indexed_at
+                       OR n.processed_at >= s.indexed_at)
+                ORDER BY c.doc_id, c.page_no, c.chunk_no
+                LIMIT %s
+                """,
+                (*after, force, page_size),
+            )
+            rows = cur.fetchall()
+            if not rows:
+                return
+            entities = chunk_entities(cur, [row[0] for row in rows])
+
+        page = []
+        for (
+            chunk_id,
+            doc_id,
+            page_no,
+            chunk_no,
+            text,
+            file_sha256,
+            source_url,
+            source_host,
+            dataset,
+            published_date,
+            title,
+            meili_id,
+            fingerprint,
+        ) in rows:
+            names, entity_ids = entities.get(chunk_id, ([], []))
+            record = {
+                "chunk_id": meili_chunk_id(file_sha256, page_no, chunk_no),
+                "doc_id": str(doc_id),
+                "page_no": page_no,
+                "text": text,
+                "dataset": dataset,
+                "published_date": published_date.isoformat() if published_date else None,
+                "entities": names,
+                "entity_ids": entity_ids,
+                "source_url": source_url,
+                "title": title,
+                "source_host": source_host,
+            }
+            page.append((str(chunk_id), record, meili_id, fingerprint))
+        yield page
+        last = rows[-1]
+        after = (last[1], last[2], last[3])
+
+
+def chunk_entities(cur, chunk_ids: list) -> dict:
+    # chunk id -> (entity names, entity ids), aligned and sorted by name.
+    cur.execute(
+        """
+        SELECT chunk_id,
+               array_agg(canonical_text ORDER BY canonical_text, entity_id),
+               array_agg(entity_id::text ORDER BY canonical_text, entity_id)
+        FROM (
+          SELECT DISTINCT m.chunk_id, m.entity_id, e.canonical_text
+          FROM entity_mentions m
+          JOIN entities e ON e.id = m.entity_id
+          WHERE m.chunk_id = ANY(%s::uuid[])
+        ) mentioned
+        GROUP BY chunk_id
+        """,
+        (chunk_ids,),
+    )
+    return {chunk_id: (names, ids) for chunk_id, names, ids in cur}
+
+
+def record_indexed(cur, rows: list[tuple[str, str, str]], *, indexed_at: str) -> None:
+    chunk_ids, meili_ids, fingerprints = zip(*rows)
+    cur.execute(
+        """
+        INSERT INTO chunk_index_state (chunk_id, meili_id, fingerprint, indexed_at)
+        SELECT chunk_id, meili_id, fingerprint, %s
+        FROM unnest(%s::uuid[], %s::text[], %s::text[]) AS t(chunk_id, meili_id, fingerprint)
+        ON CONFLICT (chunk_id) DO UPDATE SET
+          meili_id = EXCLUDED.meili_id,
+          fingerprint = EXCLUDED.fingerprint,
+          indexed_at = EXCLUDED.indexed_at
+        """,
+        (indexed_at, list(chunk_ids), list(meili_ids), list(fingerprints)),
+    )
+
+
+def stale_search_ids(cur, replaced: list[str]) -> list[tuple[str, list[str], bool]]:
+    # (search id, state rows of deleted chunks holding it, still used by a
+    # live chunk) for ids of deleted chunks and ids replaced in this run.
+    cur.execute(
+        """
+        WITH gone AS (
+          SELECT s.chunk_id, s.meili_id FROM chunk_index_state s
+          WHERE NOT EXISTS (SELECT 1 FROM chunks c WHERE c.id = s.chunk_id)
+        ),
+        candidates AS (
+          SELECT meili_id FROM gone
+          UNION
+          SELECT unnest(%s::text[])
+        )
+        SELECT k.meili_id,
+               ARRAY(SELECT g.chunk_id::text FROM gone g WHERE g.meili_id = k.meili_id),
+               EXISTS (
+                 SELECT 1 FROM chunk_index_state s
+                 JOIN chunks c ON c.id = s.chunk_id
+                 WHERE s.meili_id = k.meili_id
+               )
+        FROM candidates k
+        ORDER BY k.meili_id
+        """,
+        (replaced,),
+    )
+    return cur.fetchall()
+
+
+def forget_chunks(cur, chunk_ids: list[str]) -> None:
+    if chunk_ids:
+        cur.execute("DELETE FROM chunk_index_state WHERE chunk_id = ANY(%s::uuid[])", (chunk_ids,))
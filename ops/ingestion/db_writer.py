@@ -1,35 +1,67 @@
 from __future__ import annotations
 
 import hashlib
-import json
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Iterable
 from urllib.parse import urlparse
 
-from state import save_state
+from processed_io import iter_chunks, read_header
+from state import StateStore
+
+DOCUMENT_COLUMNS = (
+    "source_url",
+    "source_host",
+    "file_sha256",
+    "pipeline_version",
+    "page_count",
+    "ocr_quality",
+)
+CHUNK_COLUMNS = (
+    "source_url",
+    "page_no",
+    "chunk_no",
+    "text",
+    "start_char",
+    "end_char",
+    "chunk_sha256",
+)
+
+
+@dataclass
+class LoadBatch:
+    # source_url -> (document row, processed output path)
+    documents: dict[str, tuple[tuple, Path]] = field(default_factory=dict)
+    # source_url -> [(url, meta)] waiting for the document id
+    urls: dict[str, list[tuple[str, dict]]] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+
+@dataclass
+class LoadStats:
+    documents: int = 0
+    unchanged_documents: int = 0
+    chunks_inserted: int = 0
+    chunks_updated: int = 0
+    chunks_deleted: int = 0
+
+    def add(self, other: "LoadStats") -> None:
+        self.documents += other.documents
+        self.unchanged_documents += other.unchanged_documents
+        self.chunks_inserted += other.chunks_inserted
+        self.chunks_updated += other.chunks_updated
+        self.chunks_deleted += other.chunks_deleted
 
 
 def load_processed_into_db(
     *,
     database_url: str,
-    state_path: Path,
+    store: StateStore,
     max_docs: int | None = None,
-) -> int:
-    state = json.loads(state_path.read_text(encoding="utf-8"))
-    url_meta = state.get("url_meta", {})
-
-    processed_entries = [
-        (url, meta)
-        for url, meta in url_meta.items()
-        if meta.get("processed_output")
-    ]
-
-    if max_docs is not None:
-        processed_entries = processed_entries[:max_docs]
-
-    if not processed_entries:
-        return 0
-
+    batch_docs: int = 200,
+    force: bool = False,
+) -> LoadStats:
     try:
         import psycopg
     except ModuleNotFoundError as exc:  # pragma: no cover - runtime dependency
@@ -37,73 +69,172 @@ def load_processed_into_db(
             "psycopg is required. Install with: pip install -r ops/requirements.txt"
         ) from exc
 
-    inserted_docs = 0
+    stats = LoadStats()
+    batch = LoadBatch()
 
     with psycopg.connect(database_url) as conn:
-        with conn.cursor() as cur:
-            for url, meta in processed_entries:
-                processed_path = Path(meta["processed_output"])
-                if not processed_path.exists():
-                    continue
-
-                payload = json.loads(processed_path.read_text(encoding="utf-8"))
-                file_sha256 = payload.get("file_sha256")
-                page_count = payload.get("page_count")
-                source_url = meta.get("final_url") or url
-                source_host = meta.get("source_host") or urlparse(source_url).netloc
-
-                cur.execute(
-                    """
-                    INSERT INTO documents (source_url, source_host, file_sha256, page_count)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (source_url)
-                    DO UPDATE SET
-                      file_sha256 = EXCLUDED.file_sha256,
-                      page_count = EXCLUDED.page_count,
-                      updated_at = now()
-                    RETURNING id
-                    """,
-                    (source_url, source_host, file_sha256, page_count),
-                )
-                row = cur.fetchone()
-                if not row:
-                    continue
-                doc_id = row[0]
-                meta["doc_id"] = str(doc_id)
-
-                chunks = payload.get("chunks", [])
-                write_chunks(cur, doc_id, chunks)
-
-                inserted_docs += 1
-            conn.commit()
-
-    save_state(state_path, state)
-
-    return inserted_docs
-
-
-def write_chunks(cur, doc_id, chunks: Iterable[dict]) -> None:
-    for chunk in chunks:
-        text = chunk.get("text", "")
-        chunk_sha256 = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        for url, meta in store.iter_urls(processed=True):
+            if max_docs is not None and stats.documents + len(batch) >= max_docs:
+                break
+            processed_path = Path(meta["processed_output"])
+            if not processed_path.exists():
+                continue
+
+            header = read_header(processed_path)
+            load_key = db_load_key(header)
+            if not force and meta.get("doc_id") and meta.get("db_loaded") == load_key:
+                continue
+
+            source_url = meta.get("final_url") or url
+            source_host = meta.get("source_host") or urlparse(source_url).netloc
+            meta["db_loaded"] = load_key
+            batch.urls.setdefault(source_url, []).append((url, meta))
+            batch.documents[source_url] = (
+                (
+                    source_url,
+                    source_host,
+                    header.get("file_sha256"),
+                    header.get("pipeline_version"),
+                    header.get("page_count"),
+                    header.get("ocr_quality"),
+                ),
+                processed_path,
+            )
+
+            if len(batch) >= batch_docs:
+                stats.add(flush_batch(conn, store, batch, force=force))
+                batch = LoadBatch()
+
+        if batch:
+            stats.add(flush_batch(conn, store, batch, force=force))
+
+    return stats
+
+
+def db_load_key(header: dict) -> str:
+    return f"{header.get('file_sha256')}:{header.get('pipeline_version')}"
+
+
+def flush_batch(conn, store: StateStore, batch: LoadBatch, *, force: bool = False) -> LoadStats:
+    # Documents whose file_sha256 and pipeline_version already match Postgres
+    # are skipped outright. The rest are COPY'd into the unlogged staging
+    # tables and merged set-based: only chunks whose hash or offsets differ
+    # are written, and chunks that disappeared are deleted, so a re-sync of
+    # unchanged data produces no dead tuples. State is only updated once
+    # Postgres has committed, so an interrupted load resumes at this batch.
+    stats = LoadStats(documents=len(batch))
+    with conn.cursor() as cur:
         cur.execute(
-            """
-            INSERT INTO chunks (doc_id, page_no, chunk_no, text, start_char, end_char, chunk_sha256)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (doc_id, page_no, chunk_no)
-            DO UPDATE SET
-              text = EXCLUDED.text,
-              start_char = EXCLUDED.start_char,
-              end_char = EXCLUDED.end_char,
-              chunk_sha256 = EXCLUDED.chunk_sha256
-            """,
-            (
-                doc_id,
-                chunk.get("page_no"),
-                chunk.get("chunk_no"),
-                text,
-                chunk.get("start_char"),
-                chunk.get("end_char"),
-                chunk_sha256,
-            ),
+            "SELECT source_url, id, file_sha256, pipeline_version FROM documents "
+            "WHERE source_url = ANY(%s)",
+            (list(batch.documents),),
         )
+        doc_ids: dict[str, str] = {}
+        changed = dict(batch.documents)
+        for source_url, doc_id, file_sha256, version in cur.fetchall():
+            doc_ids[source_url] = str(doc_id)
+            row, _ = batch.documents[source_url]
+            if not force and (file_sha256, version) == (row[2], row[3]):
+                del changed[source_url]
+                stats.unchanged_documents += 1
+
+        if changed:
+            cur.execute("TRUNCATE staging_documents, staging_chunks")
+            with cur.copy(
+                f"COPY staging_documents ({', '.join(DOCUMENT_COLUMNS)}) FROM STDIN"
+            ) as copy:
+                for row, _ in changed.values():
+                    copy.write_row(row)
+            with cur.copy(
+                f"COPY staging_chunks ({', '.join(CHUNK_COLUMNS)}) FROM STDIN"
+            ) as copy:
+                for source_url, (_, processed_path) in changed.items():
+                    for chunk in iter_chunks(processed_path):
+                        copy.write_row(chunk_row(source_url, chunk))
+            cur.execute("ANALYZE staging_chunks")
+
+            cur.execute(
+                """
+                INSERT INTO documents
+                  (source_url, source_host, file_sha256, pipeline_version, page_count, ocr_quality)
+                SELECT source_url, source_host, file_sha256, pipeline_version, page_count, ocr_quality
+                FROM staging_documents
+                ON CONFLICT (source_url)
+                DO UPDATE SET
+                  file_sha256 = EXCLUDED.file_sha256,
+                  pipeline_version = EXCLUDED.pipeline_version,
+                  page_count = EXCLUDED.page_count,
+                  ocr_quality = EXCLUDED.ocr_quality,
+                  updated_at = now()
+                WHERE (documents.file_sha256, documents.pipeline_version,
+                       documents.page_count, documents.ocr_quality)
+                  IS DISTINCT FROM
+                      (EXCLUDED.file_sha256, EXCLUDED.pipeline_version,
+                       EXCLUDED.page_count, EXCLUDED.ocr_quality)
+                RETURNING id, source_url
+                """
+            )
+            doc_ids.update({source_url: str(doc_id) for doc_id, source_url in cur.fetchall()})
+
+            cur.execute(
+                """
+                DELETE FROM chunks c
+                USING staging_documents sd
+                JOIN documents d ON d.source_url = sd.source_url
+                WHERE c.doc_id = d.id
+                  AND NOT EXISTS (
+                    SELECT 1 FROM staging_chunks s
+                    WHERE s.source_url = sd.source_url
+                      AND s.page_no = c.page_no
+                      AND s.chunk_no = c.chunk_no
+                  )
+                """
+            )
+            stats.chunks_deleted = cur.rowcount
+
+            cur.execute(
+                """
+                INSERT INTO chunks (doc_id, page_no, chunk_no, text, start_char, end_char, chunk_sha256)
+                SELECT d.id, s.page_no, s.chunk_no, s.text, s.start_char, s.end_char, s.chunk_sha256
+                FROM staging_chunks s
+                JOIN documents d ON d.source_url = s.source_url
+                LEFT JOIN chunks c
+                  ON c.doc_id = d.id AND c.page_no = s.page_no AND c.chunk_no = s.chunk_no
+                WHERE c.id IS NULL
+                   OR (c.chunk_sha256, c.start_char, c.end_char)
+                      IS DISTINCT FROM (s.chunk_sha256, s.start_char, s.end_char)
+                ON CONFLICT (doc_id, page_no, chunk_no)
+                DO UPDATE SET
+                  text = EXCLUDED.text,
+                  start_char = EXCLUDED.start_char,
+                  end_char = EXCLUDED.end_char,
+                  chunk_sha256 = EXCLUDED.chunk_sha256
+                RETURNING (xmax = 0)
+                """
+            )
+            for (inserted,) in cur.fetchall():
+                if inserted:
+                    stats.chunks_inserted += 1
+                else:
+                    stats.chunks_updated += 1
+    conn.commit()
+
+    for source_url, entries in batch.urls.items():
+        for url, meta in entries:
+            meta["doc_id"] = doc_ids[source_url]
+            store.put_url(url, meta)
+    store.commit()
+    return stats
+
+
+def chunk_row(source_url: str, chunk: dict) -> tuple:
+    text = chunk.get("text", "")
+    return (
+        source_url,
+        chunk.get("page_no"),
+        chunk.get("chunk_no"),
+        text,
+        chunk.get("start_char"),
+        chunk.get("end_char"),
+        hashlib.sha256(text.encode("utf-8")).hexdigest(),
+    )
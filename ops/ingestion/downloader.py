@@ -1,79 +1,190 @@
 import hashlib
-import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 from urllib.parse import urlparse
 
-from http_client import fetch_url
-from rate_limiter import RateLimiter
+from http_client import HttpClient, HttpError, range_validator
+from rate_limiter import HostRateLimiter
+from state import Checkpoint, StateStore
 
 
 def download_all(
     *,
     urls: list[str],
-    state: dict,
+    store: StateStore,
     download_dir: Path,
     rate_limit_seconds: float,
-    user_agent: str,
+    client: HttpClient,
+    checkpoint: Checkpoint,
+    concurrency: int = 1,
+) -> int:
+    limiter = HostRateLimiter(rate_limit_seconds)
+
+    # At most concurrency * 2 downloads are queued at a time, so an error or
+    # Ctrl-C leaves only those running instead of the whole remaining list.
+    pending = iter(urls)
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        in_flight: dict = {}
+
+        def fill() -> None:
+            while len(in_flight) < max(1, concurrency) * 2:
+                url = next(pending, None)
+                if url is None:
+                    return
+                future = pool.submit(
+                    fetch_one,
+                    url,
+                    headers=conditional_headers(store.get_url(url)),
+                    partial=store.get_partial(url),
+                    download_dir=download_dir,
+                    limiter=limiter,
+                    client=client,
+                )
+                in_flight[future] = url
+
+        fill()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = in_flight.pop(future)
+                apply_outcome(url, future.result(), store=store)
+                checkpoint.done(url)
+                completed += 1
+            fill()
+
+    return completed
+
+
+def conditional_headers(cached: dict | None) -> dict[str, str]:
+    headers: dict[str, str] = {}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    return headers
+
+
+def fetch_one(
+    url: str,
+    *,
+    headers: dict[str, str],
+    partial: dict | None,
+    download_dir: Path,
+    limiter: HostRateLimiter,
+    client: HttpClient,
 ) -> dict:
-    limiter = RateLimiter(rate_limit_seconds)
+    part_path = partial_path(download_dir, url)
+    resume_validator = None
+    if partial and part_path.exists():
+        resume_validator = partial.get("validator")
+    else:
+        part_path.unlink(missing_ok=True)
+
+    limiter.wait(url)
+    try:
+        result = client.stream_to_file(
+            url,
+            part_path=part_path,
+            extra_headers=headers,
+            resume_validator=resume_validator,
+        )
+    except HttpError as exc:
+        return {"status": "error", "error": exc.as_dict()}
+
+    if result.partial:
+        return {
+            "status": "partial",
+            "error": result.error,
+            "partial": {
+                "path": str(part_path),
+                "offset": result.size,
+                "validator": range_validator(result.headers),
+                "etag": result.headers.get("etag"),
+                "last_modified": result.headers.get("last-modified"),
+            },
+        }
 
-    url_meta = state.setdefault("url_meta", {})
-    file_index = state.setdefault("files", {})
+    if result.status == 304:
+        return {"status": 304}
+
+    outcome = {
+        "status": result.status,
+        "final_url": result.final_url,
+        "etag": result.headers.get("etag"),
+        "last_modified": result.headers.get("last-modified"),
+        "file_type": sniff_file_type(result.head),
+    }
+    if blocked_reason(result.final_url, outcome["file_type"]):
+        result.tmp_path.unlink(missing_ok=True)
+        return outcome
+
+    file_path = download_dir / result.sha256
+    if file_path.exists():
+        result.tmp_path.unlink(missing_ok=True)
+    else:
+        os.replace(result.tmp_path, file_path)
+    outcome["sha256"] = result.sha256
+    outcome["path"] = str(file_path)
+    outcome["size"] = result.size
+    outcome["resumed_from"] = result.resumed_from
+    return outcome
+
+
+def partial_path(download_dir: Path, url: str) -> Path:
+    url_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return download_dir / "partial" / f"{url_hash}.part"
+
+
+def apply_outcome(url: str, outcome: dict, *, store: StateStore) -> None:
+    if outcome.get("error"):
+        store.put_error(url, outcome["error"])
+    else:
+        store.delete_error(url)
+
+    if outcome["status"] == "partial":
+        store.put_partial(url, outcome["partial"])
+        return
+    store.delete_partial(url)
+    if outcome["status"] == "error":
+        return
 
-    for url in urls:
-        cached = url_meta.get(url)
-        headers = {}
+    if outcome["status"] == 304:
+        cached = store.get_url(url)
         if cached:
-            if cached.get("etag"):
-                headers["If-None-Match"] = cached["etag"]
-            if cached.get("last_modified"):
-                headers["If-Modified-Since"] = cached["last_modified"]
-
-        limiter.wait()
-        result = fetch_url(url, user_agent=user_agent, extra_headers=headers)
-        if result is None:
-            continue
-        content, final_url, response_headers, status = result
-
-        if status == 304 and cached:
             refresh_cached_metadata(cached)
-            continue
-
-        file_type = sniff_file_type(content)
-        blocked = None
-        if "/age-verify" in (final_url or ""):
-            blocked = "age_verify"
-        elif file_type == "html":
-            blocked = "html_response"
-
-        if blocked:
-            url_meta[url] = {
-                "final_url": final_url,
-                "etag": response_headers.get("etag"),
-                "last_modified": response_headers.get("last-modified"),
-                "file_type": file_type,
-                "blocked": blocked,
-                "source_host": urlparse(final_url).netloc,
-            }
-            continue
-
-        sha256 = hashlib.sha256(content).hexdigest()
-        file_path = download_dir / sha256
-        if not file_path.exists():
-            file_path.write_bytes(content)
-
-        url_meta[url] = {
-            "final_url": final_url,
-            "etag": response_headers.get("etag"),
-            "last_modified": response_headers.get("last-modified"),
-            "sha256": sha256,
-            "path": str(file_path),
-            "source_host": urlparse(final_url).netloc,
-            "file_type": file_type,
-        }
-        file_index.setdefault(sha256, {"path": str(file_path)})
+            store.put_url(url, cached)
+        return
+
+    final_url = outcome["final_url"]
+    entry = {
+        "final_url": final_url,
+        "etag": outcome["etag"],
+        "last_modified": outcome["last_modified"],
+        "source_host": urlparse(final_url).netloc,
+        "file_type": outcome["file_type"],
+    }
+    blocked = blocked_reason(final_url, outcome["file_type"])
+    if blocked:
+        entry["blocked"] = blocked
+        store.put_url(url, entry)
+        return
+
+    entry["sha256"] = outcome["sha256"]
+    entry["path"] = outcome["path"]
+    entry["size"] = outcome["size"]
+    store.put_url(url, entry)
+    store.setdefault_file(outcome["sha256"], {"path": outcome["path"]})
+
 
-    return state
+def blocked_reason(final_url: str | None, file_type: str) -> str | None:
+    if "/age-verify" in (final_url or ""):
+        return "age_verify"
+    if file_type == "html":
+        return "html_response"
+    return None
 
 
 def sniff_file_type(content: bytes) -> str:
@@ -98,12 +209,7 @@ def refresh_cached_metadata(cached: dict) -> None:
         return
 
     file_type = sniff_file_type(head)
-    final_url = cached.get("final_url") or ""
-    blocked = None
-    if "/age-verify" in final_url:
-        blocked = "age_verify"
-    elif file_type == "html":
-        blocked = "html_response"
+    blocked = blocked_reason(cached.get("final_url"), file_type)
 
     cached["file_type"] = file_type
     if blocked:
@@ -24,10 +24,23 @@ class ExtractResult:
 
 
 def extract_pdf_text(path: Path) -> ExtractResult:
+    return extract_pdf_pages(path)
+
+
+def extract_pdf_pages(
+    path: Path,
+    start: int = 0,
+    end: int | None = None,
+) -> ExtractResult:
     doc = fitz.open(path)
-    pages: list[PageText] = []
-    for i in range(len(doc)):
-        page = doc.load_page(i)
-        text = page.get_text("text")
-        pages.append(PageText(page_no=i + 1, text=text))
-    return ExtractResult(pages=pages, page_count=len(doc))
+    try:
+        page_count = len(doc)
+        stop = page_count if end is None else min(end, page_count)
+        pages: list[PageText] = []
+        for i in range(start, stop):
+            page = doc.load_page(i)
+            text = page.get_text("text")
+            pages.append(PageText(page_no=i + 1, text=text))
+        return ExtractResult(pages=pages, page_count=page_count)
+    finally:
+        doc.close()
@@ -1,27 +1,475 @@
-import urllib.request
-from typing import Any
+import hashlib
+import http.client
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from urllib.parse import urljoin, urlsplit
 
+STREAM_CHUNK_SIZE = 1024 * 1024
+SNIFF_BYTES = 2048
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
 
-def fetch_url(
-    url: str,
-    *,
-    user_agent: str,
-    extra_headers: dict[str, str] | None = None,
-) -> tuple[bytes, str] | tuple[bytes, str, dict[str, str], int] | None:
-    headers = {"User-Agent": user_agent}
-    if extra_headers:
-        headers.update(extra_headers)
 
-    request = urllib.request.Request(url, headers=headers)
-    try:
-        with urllib.request.urlopen(request, timeout=30) as response:
-            content = response.read()
-            final_url = response.geturl()
-            response_headers = {k.lower(): v for k, v in response.headers.items()}
-            return content, final_url, response_headers, response.status
-    except urllib.error.HTTPError as exc:
-        if exc.code == 304:
-            return b"", url, {k.lower(): v for k, v in exc.headers.items()}, 304
+class HttpError(Exception):
+    def __init__(
+        self,
+        url: str,
+        *,
+        status: int | None = None,
+        reason: str = "",
+        retryable: bool = False,
+        attempts: int = 1,
+        retry_after: float | None = None,
+    ) -> None:
+        super().__init__(f"{url}: {status or 'no response'} {reason}".strip())
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.retryable = retryable
+        self.attempts = attempts
+        self.retry_after = retry_after
+
+    def as_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "reason": self.reason,
+            "retryable": self.retryable,
+            "attempts": self.attempts,
+        }
+
+
+@dataclass
+class HttpResponse:
+    status: int
+    final_url: str
+    headers: dict[str, str]
+    body: bytes = b""
+
+
+@dataclass
+class StreamResult:
+    status: int
+    final_url: str
+    headers: dict[str, str]
+    tmp_path: Path | None = None
+    sha256: str | None = None
+    size: int = 0
+    head: bytes = b""
+    resumed_from: int = 0
+    partial: bool = False
+    error: dict | None = field(default=None)
+
+
+class HttpClient:
+    # Keeps one persistent connection per (scheme, host) per thread, so worker
+    # pools reuse TCP/TLS sessions without sharing a connection across threads.
+
+    def __init__(
+        self,
+        *,
+        user_agent: str,
+        timeout: float = 30.0,
+        max_attempts: int = 5,
+        backoff_base: float = 2.0,
+        backoff_max: float = 60.0,
+        max_redirects: int = 5,
+    ) -> None:
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_redirects = max_redirects
+        self._local = threading.local()
+        self._pools: list[dict] = []
+        self._pools_lock = threading.Lock()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        headers: dict[str, str] | None = None,
+        body: bytes | None = None,
+        idempotent: bool | None = None,
+    ) -> HttpResponse:
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempts = self.max_attempts if idempotent else 1
+        last_error: HttpError | None = None
+
+        for attempt in range(1, attempts + 1):
+            final_url = None
+            try:
+                response, final_url = self._send(method, url, headers or {}, body)
+                payload = response.read()
+                self._release(final_url, response)
+            except (OSError, http.client.HTTPException) as exc:
+                # _send drops the connection of a hop that failed; a failed
+                # read leaves the final hop's connection unusable.
+                if final_url is not None:
+                    self._drop(final_url)
+                last_error = HttpError(
+                    url, reason=type(exc).__name__, retryable=True, attempts=attempt
+                )
+                if attempt < attempts:
+                    time.sleep(self.backoff_delay(attempt))
+                continue
+
+            response_headers = normalize_headers(response)
+            if 200 <= response.status < 300 or response.status == 304:
+                return HttpResponse(response.status, final_url, response_headers, payload)
+
+            retryable = response.status in RETRY_STATUSES
+            last_error = HttpError(
+                final_url,
+                status=response.status,
+                reason=response.reason,
+                retryable=retryable,
+                attempts=attempt,
+            )
+            if not retryable or attempt >= attempts:
+                break
+            time.sleep(
+                self.retry_delay(
+                    attempt, parse_retry_after(response_headers.get("retry-after"))
+                )
+            )
+
+        assert last_error is not None
+        raise last_error
+
+    def fetch(
+        self,
+        url: str,
+        *,
+        extra_headers: dict[str, str] | None = None,
+    ) -> HttpResponse:
+        return self.request("GET", url, headers=extra_headers)
+
+    def stream_to_file(
+        self,
+        url: str,
+        *,
+        part_path: Path,
+        extra_headers: dict[str, str] | None = None,
+        resume_validator: str | None = None,
+    ) -> StreamResult:
+        last_error: HttpError | None = None
+        result: StreamResult | None = None
+
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                result = self._stream_once(
+                    url,
+                    part_path=part_path,
+                    extra_headers=extra_headers,
+                    resume_validator=resume_validator,
+                )
+                return result
+            except _PartialTransfer as exc:
+                result = exc.result
+                last_error = HttpError(
+                    url, reason=exc.reason, retryable=True, attempts=attempt
+                )
+                if is_resumable(result.headers):
+                    resume_validator = range_validator(result.headers)
+                else:
+                    part_path.unlink(missing_ok=True)
+                    resume_validator = None
+                    result = None
+                if attempt < self.max_attempts:
+                    time.sleep(self.backoff_delay(attempt))
+            except HttpError as exc:
+                exc.attempts = attempt
+                last_error = exc
+                if exc.status == 416:
+                    part_path.unlink(missing_ok=True)
+                    resume_validator = None
+                elif not exc.retryable:
+                    break
+                if attempt < self.max_attempts:
+                    time.sleep(self.retry_delay(attempt, exc.retry_after))
+
+        assert last_error is not None
+        if result is not None and part_path.exists():
+            result.partial = True
+            result.tmp_path = part_path
+            result.size = part_path.stat().st_size
+            result.error = last_error.as_dict()
+            return result
+        raise last_error
+
+    def __enter__(self) -> "HttpClient":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        with self._pools_lock:
+            for pool in self._pools:
+                for conn in list(pool.values()):
+                    conn.close()
+                pool.clear()
+
+    def backoff_delay(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (attempt - 1)))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def retry_delay(self, attempt: int, retry_after: float | None) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max * 5)
+        return self.backoff_delay(attempt)
+
+    def _stream_once(
+        self,
+        url: str,
+        *,
+        part_path: Path,
+        extra_headers: dict[str, str] | None,
+        resume_validator: str | None,
+    ) -> StreamResult:
+        headers = dict(extra_headers or {})
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        if offset and resume_validator:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = resume_validator
+            headers.pop("If-None-Match", None)
+            headers.pop("If-Modified-Since", None)
+        else:
+            offset = 0
+
+        try:
+            response, final_url = self._send("GET", url, headers, None)
+        except (OSError, http.client.HTTPException) as exc:
+            raise HttpError(url, reason=type(exc).__name__, retryable=True) from exc
+
+        result = StreamResult(
+            status=response.status,
+            final_url=final_url,
+            headers=normalize_headers(response),
+        )
+        if response.status == 304:
+            response.read()
+            self._release(final_url, response)
+            return result
+        if response.status not in (200, 206):
+            response.read()
+            self._release(final_url, response)
+            raise HttpError(
+                final_url,
+                status=response.status,
+                reason=response.reason,
+                retryable=response.status in RETRY_STATUSES,
+                retry_after=parse_retry_after(result.headers.get("retry-after")),
+            )
+
+        if response.status == 206 and (
+            not content_range_starts_at(result.headers.get("content-range"), offset)
+            or validator_changed(result.headers, resume_validator)
+        ):
+            self._drop(final_url)
+            part_path.unlink(missing_ok=True)
+            return self._stream_once(
+                url,
+                part_path=part_path,
+                extra_headers=extra_headers,
+                resume_validator=None,
+            )
+        if response.status != 206:
+            offset = 0
+
+        digest = hashlib.sha256()
+        part_path.parent.mkdir(parents=True, exist_ok=True)
+        with part_path.open("r+b" if offset else "wb") as handle:
+            if offset:
+                result.head = hash_prefix(handle, digest, offset)
+                handle.truncate(offset)
+            result.size = offset
+            try:
+                while True:
+                    block = response.read(STREAM_CHUNK_SIZE)
+                    if not block:
+                        break
+                    if len(result.head) < SNIFF_BYTES:
+                        result.head += block[: SNIFF_BYTES - len(result.head)]
+                    digest.update(block)
+                    handle.write(block)
+                    result.size += len(block)
+            except (OSError, http.client.HTTPException) as exc:
+                self._drop(final_url)
+                raise _PartialTransfer(result, type(exc).__name__) from exc
+
+        expected = result.headers.get("content-length")
+        if expected and expected.isdigit() and result.size - offset != int(expected):
+            self._drop(final_url)
+            raise _PartialTransfer(result, "IncompleteRead")
+
+        self._release(final_url, response)
+        result.tmp_path = part_path
+        result.sha256 = digest.hexdigest()
+        result.resumed_from = offset
+        return result
+
+    def _send(
+        self,
+        method: str,
+        url: str,
+        headers: dict[str, str],
+        body: bytes | None,
+    ) -> tuple[http.client.HTTPResponse, str]:
+        request_headers = {"User-Agent": self.user_agent}
+        request_headers.update(headers)
+        current = url
+
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(current)
+            path = parts.path or "/"
+            if parts.query:
+                path = f"{path}?{parts.query}"
+
+            conn, reused = self._connection(parts.scheme, parts.netloc)
+            try:
+                try:
+                    conn.request(method, path, body=body, headers=request_headers)
+                    response = conn.getresponse()
+                except (OSError, http.client.HTTPException):
+                    if not reused:
+                        raise
+                    # Stale keep-alive connection: retry once on a fresh socket.
+                    self._drop(current)
+                    conn, _ = self._connection(parts.scheme, parts.netloc)
+                    conn.request(method, path, body=body, headers=request_headers)
+                    response = conn.getresponse()
+
+                location = response.getheader("Location")
+                redirect = response.status in REDIRECT_STATUSES and bool(location)
+                if redirect:
+                    response.read()
+                    self._release(current, response)
+            except (OSError, http.client.HTTPException):
+                # Drop the connection of the hop that failed, which after a
+                # redirect is not the one for the requested URL.
+                self._drop(current)
+                raise
+
+            if not redirect:
+                return response, current
+            current = urljoin(current, location)
+            if response.status == 303:
+                method, body = "GET", None
+
+        raise HttpError(url, reason="too many redirects")
+
+    def _connection(
+        self, scheme: str, netloc: str
+    ) -> tuple[http.client.HTTPConnection, bool]:
+        pool = self._pool()
+        key = (scheme, netloc)
+        conn = pool.get(key)
+        if conn is not None:
+            return conn, True
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        elif scheme == "http":
+            conn = http.client.HTTPConnection(netloc, timeout=self.timeout)
+        else:
+            raise HttpError(f"{scheme}://{netloc}", reason=f"unsupported scheme {scheme!r}")
+        pool[key] = conn
+        return conn, False
+
+    def _release(self, url: str, response: http.client.HTTPResponse) -> None:
+        if response.will_close:
+            self._drop(url)
+
+    def _drop(self, url: str) -> None:
+        parts = urlsplit(url)
+        conn = self._pool().pop((parts.scheme, parts.netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def _pool(self) -> dict[tuple[str, str], http.client.HTTPConnection]:
+        pool = getattr(self._local, "pool", None)
+        if pool is None:
+            pool = {}
+            self._local.pool = pool
+            with self._pools_lock:
+                self._pools.append(pool)
+        return pool
+
+
+class _PartialTransfer(Exception):
+    def __init__(self, result: StreamResult, reason: str) -> None:
+        super().__init__(reason)
+        self.result = result
+        self.reason = reason
+
+
+def normalize_headers(response: http.client.HTTPResponse) -> dict[str, str]:
+    return {k.lower(): v for k, v in response.getheaders()}
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
         return None
-    except Exception:
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
         return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def hash_prefix(handle, digest, length: int) -> bytes:
+    head = b""
+    remaining = length
+    while remaining > 0:
+        block = handle.read(min(STREAM_CHUNK_SIZE, remaining))
+        if not block:
+            break
+        if len(head) < SNIFF_BYTES:
+            head += block[: SNIFF_BYTES - len(head)]
+        digest.update(block)
+        remaining -= len(block)
+    return head
+
+
+def content_range_starts_at(content_range: str | None, offset: int) -> bool:
+    if not content_range or not content_range.startswith("bytes "):
+        return False
+    try:
+        start = int(content_range[len("bytes ") :].split("-", 1)[0])
+    except ValueError:
+        return False
+    return start == offset
+
+
+def validator_changed(headers: dict[str, str], validator: str | None) -> bool:
+    if not validator:
+        return False
+    if validator.startswith('"'):
+        current = headers.get("etag")
+    else:
+        current = headers.get("last-modified")
+    return bool(current) and current != validator
+
+
+def range_validator(headers: dict[str, str]) -> str | None:
+    etag = headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("last-modified")
+
+
+def is_resumable(headers: dict[str, str]) -> bool:
+    if headers.get("accept-ranges", "").lower() != "bytes":
+        return False
+    return range_validator(headers) is not None
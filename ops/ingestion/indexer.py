@@ -1,74 +1,372 @@
 from __future__ import annotations
 
+import gzip
+import hashlib
 import json
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable
+from typing import Callable, Iterable, Iterator, TypeVar
 from urllib.parse import urlparse
 
+from http_client import HttpClient, HttpError
+from processed_io import iter_chunks, read_header
+from state import StateStore
+
+
+INDEX_UID = "chunks"
+DEFAULT_BATCH_BYTES = 10 * 1024 * 1024
+TASK_FINAL_STATUSES = {"succeeded", "failed", "canceled"}
+
+T = TypeVar("T")
+
+
+class MeiliTaskError(RuntimeError):
+    def __init__(self, failed: list[dict]) -> None:
+        self.failed = failed
+        first = failed[0]
+        reason = (first.get("error") or {}).get("message") or first.get("status")
+        super().__init__(f"{len(failed)} Meilisearch task(s) did not succeed, first: {reason}")
+
 
 class MeiliIndexer:
-    def __init__(self, host: str, master_key: str) -> None:
+    def __init__(self, host: str, master_key: str, client: HttpClient) -> None:
         self.host = host.rstrip("/")
         self.master_key = master_key
+        self.client = client
 
-    def upsert_chunks(self, chunks: list[dict]) -> None:
-        import urllib.request
-
-        url = f"{self.host}/indexes/chunks/documents"
-        payload = json.dumps(chunks).encode("utf-8")
-        req = urllib.request.Request(
-            url,
-            data=payload,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.master_key}",
-            },
-            method="POST",
+    def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        body: bytes | None = None,
+        headers: dict[str, str] | None = None,
+        idempotent: bool | None = None,
+    ) -> dict:
+        all_headers = {"Authorization": f"Bearer {self.master_key}"}
+        if body is not None:
+            all_headers["Content-Type"] = "application/json"
+        all_headers.update(headers or {})
+        response = self.client.request(
+            method,
+            f"{self.host}{path}",
+            headers=all_headers,
+            body=body,
+            idempotent=idempotent,
         )
-        with urllib.request.urlopen(req, timeout=30) as resp:
-            resp.read()
+        return json.loads(response.body or b"{}")
 
+    def upsert_chunks(self, chunks: list[dict]) -> dict:
+        return self.upsert_payload(json.dumps(chunks).encode("utf-8"))
 
-def load_processed_outputs(
+    def upsert_payload(self, payload: bytes, *, compress: bool = False) -> dict:
+        # Upserts are keyed by chunk_id, so replaying a POST is safe to retry.
+        return self.post_payload(f"/indexes/{INDEX_UID}/documents", payload, compress=compress)
+
+    def delete_payload(self, payload: bytes, *, compress: bool = False) -> dict:
+        # payload is a JSON array of chunk ids.
+        return self.post_payload(
+            f"/indexes/{INDEX_UID}/documents/delete-batch", payload, compress=compress
+        )
+
+    def post_payload(self, path: str, payload: bytes, *, compress: bool = False) -> dict:
+        headers = {}
+        if compress:
+            payload = gzip.compress(payload, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        return self.request("POST", path, body=payload, headers=headers, idempotent=True)
+
+    def get_task(self, task_uid: int) -> dict:
+        return self.request("GET", f"/tasks/{task_uid}")
+
+
+@dataclass
+class IndexStats:
+    documents: int = 0
+    unchanged_documents: int = 0
+    records: int = 0
+    deleted: int = 0
+    batches: int = 0
+    bytes: int = 0
+    tasks: int = 0
+
+
+class IndexPipeline:
+    # Several uploader threads POST byte-sized batches while the caller keeps
+    # building the next ones. Every response's taskUid is tracked: once
+    # max_pending_tasks of our tasks are still enqueued/processing in Meili,
+    # submit() blocks and polls /tasks until the oldest completes, so Meili's
+    # queue stays bounded instead of growing faster than it indexes. finish()
+    # waits for every task and raises MeiliTaskError if any did not succeed.
+    # A batch's on_success callback runs on the caller's thread once its task
+    # succeeded.
+
+    def __init__(
+        self,
+        indexer: MeiliIndexer,
+        *,
+        uploaders: int = 4,
+        max_pending_tasks: int = 8,
+        compress: bool = False,
+        poll_seconds: float = 0.5,
+    ) -> None:
+        self.indexer = indexer
+        self.uploaders = max(1, uploaders)
+        self.max_pending_tasks = max(1, max_pending_tasks)
+        self.compress = compress
+        self.poll_seconds = poll_seconds
+        self.pool = ThreadPoolExecutor(max_workers=self.uploaders)
+        self.uploads: dict[Future, Callable[[], None] | None] = {}
+        self.tasks: deque[tuple[int, Callable[[], None] | None]] = deque()
+        self.failed: list[dict] = []
+        self.stats = IndexStats()
+
+    def submit(
+        self,
+        payload: bytes,
+        *,
+        records: int,
+        delete: bool = False,
+        on_success: Callable[[], None] | None = None,
+    ) -> None:
+        while len(self.uploads) >= self.uploaders:
+            self._collect_uploads(block=True)
+        # Uploads still in flight will become tasks too, so they count.
+        while len(self.tasks) + len(self.uploads) >= self.max_pending_tasks:
+            if self.tasks:
+                self._wait_oldest_task()
+            else:
+                self._collect_uploads(block=True)
+        send = self.indexer.delete_payload if delete else self.indexer.upsert_payload
+        future = self.pool.submit(send, payload, compress=self.compress)
+        self.uploads[future] = on_success
+        if delete:
+            self.stats.deleted += records
+        else:
+            self.stats.records += records
+        self.stats.batches += 1
+        self.stats.bytes += len(payload)
+
+    def drain(self) -> bool:
+        # Waits for every submitted batch; False if any task did not succeed.
+        while self.uploads:
+            self._collect_uploads(block=True)
+        while self.tasks:
+            self._wait_oldest_task()
+        return not self.failed
+
+    def finish(self) -> IndexStats:
+        try:
+            self.drain()
+        finally:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+        if self.failed:
+            raise MeiliTaskError(self.failed)
+        return self.stats
+
+    def _collect_uploads(self, *, block: bool) -> None:
+        done, _ = wait(self.uploads, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            on_success = self.uploads.pop(future)
+            try:
+                task_uid = future.result()["taskUid"]
+            except HttpError as exc:
+                # Still failing after the client's retries: recorded like a
+                # failed task, so finish() raises MeiliTaskError.
+                self.failed.append(request_failure(exc))
+                continue
+            self.tasks.append((task_uid, on_success))
+            self.stats.tasks += 1
+
+    def _wait_oldest_task(self) -> None:
+        task_uid, on_success = self.tasks[0]
+        while True:
+            try:
+                task = self.indexer.get_task(task_uid)
+            except HttpError as exc:
+                task = request_failure(exc)
+            if task.get("status") in TASK_FINAL_STATUSES:
+                break
+            time.sleep(self.poll_seconds)
+            if self.uploads:
+                self._collect_uploads(block=False)
+        self.tasks.popleft()
+        if task.get("status") != "succeeded":
+            self.failed.append(task)
+        elif on_success is not None:
+            on_success()
+
+
+def request_failure(exc: HttpError) -> dict:
+    # A request that failed after retries, shaped like a failed Meilisearch
+    # task for MeiliTaskError.
+    return {"status": "failed", "error": {"message": str(exc), **exc.as_dict()}}
+
+
+def iter_payloads(
+    items: Iterable[tuple[object, T]], *, max_bytes: int = DEFAULT_BATCH_BYTES
+) -> Iterator[tuple[bytes, list[T]]]:
+    # Packs (document, tag) items into JSON arrays of at most max_bytes (a
+    # single larger document is sent on its own); yields (payload, tags).
+    parts: list[bytes] = []
+    tags: list[T] = []
+    size = 2
+    for document, tag in items:
+        encoded = json.dumps(document, ensure_ascii=False).encode("utf-8")
+        if parts and size + len(encoded) + 1 > max_bytes:
+            yield b"[" + b",".join(parts) + b"]", tags
+            parts, tags, size = [], [], 2
+        parts.append(encoded)
+        tags.append(tag)
+        size += len(encoded) + 1
+    if parts:
+        yield b"[" + b",".join(parts) + b"]", tags
+
+
+def sync_index(
     *,
-    state_path: Path,
+    store: StateStore,
+    pipeline: IndexPipeline,
     max_docs: int | None = None,
-) -> Iterable[tuple[str, dict]]:
-    state = json.loads(state_path.read_text(encoding="utf-8"))
-    url_meta = state.get("url_meta", {})
-
-    processed_entries = [
-        (url, meta)
-        for url, meta in url_meta.items()
-        if meta.get("processed_output")
+    batch_bytes: int = DEFAULT_BATCH_BYTES,
+    force: bool = False,
+) -> IndexStats:
+    # Incremental sync against state["index_chunks"], which holds the
+    # fingerprint of every chunk Meilisearch has confirmed. Documents whose
+    # index_key is unchanged are skipped without reading their chunks; for the
+    # rest only new or changed chunks are sent, and chunk ids that disappeared
+    # (re-chunking, or the URL lost its processed output) are deleted in
+    # batches once all upserts are in. State only advances when a batch's
+    # task succeeded, so a failed run is retried by the next one.
+    stats = pipeline.stats
+    # url -> (meta, index_key, chunks not yet confirmed)
+    pending: dict[str, list] = {}
+    removed: list[tuple[str, str]] = []
+
+    def confirm(urls: Iterable[str]) -> None:
+        for url in urls:
+            entry = pending[url]
+            entry[2] -= 1
+            if entry[2] <= 0:
+                meta, key, _ = pending.pop(url)
+                meta["indexed"] = key
+                store.put_url(url, meta)
+
+    def changed_chunks() -> Iterator[tuple[dict, tuple[str, str, str]]]:
+        for url, meta, processed_path in load_processed_outputs(store=store, max_docs=max_docs):
+            key = index_key(meta, processed_path)
+            if not force and meta.get("indexed") == key:
+                stats.unchanged_documents += 1
+                continue
+            stats.documents += 1
+            known = store.get_index_chunks(url)
+            changed = []
+            current = set()
+            for record in build_chunk_records(url=url, meta=meta, processed_path=processed_path):
+                fingerprint = record_fingerprint(record)
+                current.add(record["chunk_id"])
+                if force or known.get(record["chunk_id"]) != fingerprint:
+                    changed.append((record, (url, record["chunk_id"], fingerprint)))
+            gone = [(url, chunk_id) for chunk_id in known if chunk_id not in current]
+            removed.extend(gone)
+            pending[url] = [meta, key, len(changed) + len(gone) + 1]
+            yield from changed
+            confirm([url])
+
+    def upserted(rows: list[tuple[str, str, str]]) -> Callable[[], None]:
+        def done() -> None:
+            store.put_index_chunks(rows)
+            confirm(url for url, _, _ in rows)
+            store.commit()
+
+        return done
+
+    for payload, rows in iter_payloads(changed_chunks(), max_bytes=batch_bytes):
+        pipeline.submit(payload, records=len(rows), on_success=upserted(rows))
+    if not pipeline.drain():
+        return pipeline.finish()  # raises MeiliTaskError
+
+    removed.extend(store.iter_orphaned_index_chunks())
+    # A chunk id is only deleted from Meilisearch when no other URL still
+    # indexes it; otherwise just this URL's state row goes.
+    by_chunk: dict[str, list[tuple[str, str]]] = {}
+    for url, chunk_id in removed:
+        by_chunk.setdefault(chunk_id, []).append((url, chunk_id))
+    deletes = []
+    for chunk_id, rows in by_chunk.items():
+        if store.index_chunk_urls(chunk_id) - {url for url, _ in rows}:
+            store.delete_index_chunks(rows)
+            confirm(url for url, _ in rows if url in pending)
+        else:
+            deletes.append((chunk_id, rows))
+    store.commit()
+
+    def deleted(rows: list[tuple[str, str]]) -> Callable[[], None]:
+        def done() -> None:
+            store.delete_index_chunks(rows)
+            confirm(url for url, _ in rows if url in pending)
+            store.commit()
+
+        return done
+
+    for payload, groups in iter_payloads(deletes, max_bytes=batch_bytes):
+        rows = [row for group in groups for row in group]
+        pipeline.submit(payload, records=len(groups), delete=True, on_success=deleted(rows))
+    return pipeline.finish()
+
+
+def index_key(meta: dict, processed_path: Path) -> str:
+    # Everything build_chunk_records reads from outside the chunk text.
+    header = read_header(processed_path)
+    parts = [
+        header.get("file_sha256"),
+        header.get("pipeline_version"),
+        meta.get("final_url"),
+        meta.get("source_host"),
+        meta.get("doc_id"),
+        meta.get("dataset"),
+        meta.get("published_date"),
+        meta.get("title"),
     ]
+    return hashlib.sha256(json.dumps(parts).encode("utf-8")).hexdigest()
+
+
+def record_fingerprint(record: dict) -> str:
+    encoded = json.dumps(record, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
 
-    if max_docs is not None:
-        processed_entries = processed_entries[:max_docs]
 
-    for url, meta in processed_entries:
+def load_processed_outputs(
+    *,
+    store: StateStore,
+    max_docs: int | None = None,
+) -> Iterable[tuple[str, dict, Path]]:
+    for url, meta in store.iter_urls(processed=True, limit=max_docs):
         processed_path = Path(meta["processed_output"])
         if not processed_path.exists():
             continue
-        payload = json.loads(processed_path.read_text(encoding="utf-8"))
-        yield url, payload
+        yield url, meta, processed_path
 
 
 def build_chunk_records(
     *,
     url: str,
     meta: dict,
-    payload: dict,
+    processed_path: Path,
 ) -> list[dict]:
     source_url = meta.get("final_url") or url
     source_host = meta.get("source_host") or urlparse(source_url).netloc
     doc_id = meta.get("doc_id")
+    file_sha256 = read_header(processed_path).get("file_sha256")
 
     chunks = []
-    for chunk in payload.get("chunks", []):
+    for chunk in iter_chunks(processed_path):
         chunks.append(
             {
-                "chunk_id": f"{payload.get('file_sha256')}:{chunk.get('page_no')}:{chunk.get('chunk_no')}",
+                "chunk_id": meili_chunk_id(file_sha256, chunk.get("page_no"), chunk.get("chunk_no")),
                 "doc_id": doc_id,
                 "page_no": chunk.get("page_no"),
                 "text": chunk.get("text"),
@@ -82,3 +380,8 @@ def build_chunk_records(
             }
         )
     return chunks
+
+
+def meili_chunk_id(file_sha256: str | None, page_no: int | None, chunk_no: int | None) -> str:
+    # Meilisearch document ids may only contain [A-Za-z0-9_-].
+    return f"{file_sha256}_{page_no}_{chunk_no}"
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+
+OCR_VERSION = 1
+GARBAGE_ALLOWED = set(".,;:'\"!?()[]-/&$%@#*+=_<>")
+# Pages with fewer tokens are scored down as near-empty (image-only scans);
+# short but clean pages are not.
+MIN_TEXT_TOKENS = 3
+
+
+@dataclass(frozen=True)
+class OcrConfig:
+    cache_dir: Path
+    threshold: float = 0.5
+    dpi: int = 300
+    lang: str = "eng"
+    timeout_seconds: float = 300.0
+
+    def fingerprint(self) -> str:
+        # Part of the pipeline version: the threshold decides which pages
+        # are replaced by OCR text, so it changes outputs.
+        return f"{self.cache_key()}-{self.threshold:g}"
+
+    def cache_key(self) -> str:
+        # What tesseract's output depends on; the threshold is not part of it.
+        return f"ocr-{OCR_VERSION}-{self.lang}-{self.dpi}"
+
+
+def text_quality(text: str) -> float:
+    # Heuristic from docs/PLAN.md: share of alphabetic tokens, plausible
+    # average token length and garbage-character rate, scaled down for pages
+    # with fewer than MIN_TEXT_TOKENS tokens (typical of image-only scans).
+    tokens = text.split()
+    if not tokens:
+        return 0.0
+    alpha_tokens = sum(
+        1 for token in tokens if sum(ch.isalpha() for ch in token) >= 0.6 * len(token)
+    )
+    alpha_ratio = alpha_tokens / len(tokens)
+
+    visible = [ch for ch in text if not ch.isspace()]
+    garbage = sum(1 for ch in visible if not ch.isalnum() and ch not in GARBAGE_ALLOWED)
+    garbage_rate = garbage / len(visible)
+
+    avg_len = len(visible) / len(tokens)
+    length_score = 1.0 if 2.5 <= avg_len <= 12 else 0.5
+    volume = min(1.0, len(tokens) / MIN_TEXT_TOKENS)
+
+    return round(alpha_ratio * (1 - garbage_rate) * length_score * volume, 4)
+
+
+def needs_ocr(text: str, threshold: float) -> bool:
+    return text_quality(text) < threshold
+
+
+def tesseract_available() -> bool:
+    return shutil.which("tesseract") is not None
+
+
+def ocr_page(path: str, page_no: int, config: OcrConfig) -> tuple[int, str, float]:
+    # Runs in a worker process. Results are cached by the sha256 of the
+    # rendered page image, so a page is never OCR'd twice, even when the
+    # same scan appears in several PDFs.
+    try:
+        import fitz  # PyMuPDF
+    except ModuleNotFoundError as exc:  # pragma: no cover - runtime dependency
+        raise ModuleNotFoundError(
+            "PyMuPDF is required. Install with: pip install -r ops/requirements.txt"
+        ) from exc
+
+    doc = fitz.open(path)
+    try:
+        pixmap = doc.load_page(page_no - 1).get_pixmap(dpi=config.dpi, colorspace=fitz.csGRAY)
+        image = pixmap.tobytes("png")
+    finally:
+        doc.close()
+
+    page_hash = hashlib.sha256(image).hexdigest()
+    cache_path = config.cache_dir / page_hash[:2] / f"{page_hash}.{config.cache_key()}.json"
+    if cache_path.exists():
+        # Quality is rescored, so a heuristic change never needs a new cache.
+        text = json.loads(cache_path.read_text(encoding="utf-8"))["text"]
+        return page_no, text, text_quality(text)
+
+    completed = subprocess.run(
+        ["tesseract", "stdin", "stdout", "-l", config.lang, "--dpi", str(config.dpi)],
+        input=image,
+        capture_output=True,
+        timeout=config.timeout_seconds,
+        check=True,
+    )
+    text = completed.stdout.decode("utf-8", errors="replace")
+    quality = text_quality(text)
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps({"text": text, "quality": quality}), encoding="utf-8")
+    os.replace(tmp_path, cache_path)
+    return page_no, text, quality
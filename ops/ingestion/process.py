@@ -1,37 +1,253 @@
 from __future__ import annotations
 
 import hashlib
-import json
-from dataclasses import asdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Iterable, Iterator
 
-from chunker import chunk_pages
+from chunker import CHUNKER_VERSION, chunk_page_text
+from ocr import OcrConfig, needs_ocr, ocr_page, text_quality
+from processed_io import OUTPUT_FORMAT_VERSION, chunk_offsets, output_path, write_processed
 
+PAGES_PER_TASK = 200
+EXTRACTOR_VERSION = 2
+# Bump EXTRACTOR_VERSION/CHUNKER_VERSION whenever output for the same bytes
+# would change; outputs recorded under an older version are rebuilt.
+PIPELINE_VERSION = (
+    f"extract-{EXTRACTOR_VERSION}.chunk-{CHUNKER_VERSION}.out-{OUTPUT_FORMAT_VERSION}"
+)
 
-def process_pdf(path: Path, output_dir: Path) -> dict:
+
+@dataclass
+class PendingDoc:
+    path: Path
+    sha256: str
+    page_count: int = 0
+    pages: list[tuple[int, str]] = field(default_factory=list)
+    ocr_results: dict[int, tuple[str, float]] = field(default_factory=dict)
+    outstanding: int = 1
+    error: str | None = None
+
+
+def pipeline_version(ocr: OcrConfig | None = None) -> str:
+    if ocr is None:
+        return PIPELINE_VERSION
+    return f"{PIPELINE_VERSION}.{ocr.fingerprint()}"
+
+
+def process_pdf(
+    path: Path,
+    output_dir: Path,
+    sha256: str | None = None,
+    compression: str = "gzip",
+    ocr: OcrConfig | None = None,
+) -> dict:
     from extractor import extract_pdf_text
 
     result = extract_pdf_text(path)
+    pages = [(page.page_no, page.text) for page in result.pages]
+    ocr_results: dict[int, tuple[str, float]] = {}
+    for page_no in ocr_candidates(pages, ocr):
+        try:
+            _, text, quality = ocr_page(str(path), page_no, ocr)
+        except Exception:  # pragma: no cover - runtime safety
+            continue
+        ocr_results[page_no] = (text, quality)
+
+    return write_output(
+        sha256 or file_sha256(path),
+        pages,
+        result.page_count,
+        output_dir,
+        compression,
+        ocr=ocr,
+        ocr_results=ocr_results,
+    )
 
-    page_payload = [
-        {"page_no": page.page_no, "text": page.text}
-        for page in result.pages
-    ]
 
-    chunks = chunk_pages([(p.page_no, p.text) for p in result.pages])
-    chunk_payload = [asdict(chunk) for chunk in chunks]
+def ocr_candidates(pages: list[tuple[int, str]], ocr: OcrConfig | None) -> list[int]:
+    if ocr is None:
+        return []
+    return [page_no for page_no, text in pages if needs_ocr(text, ocr.threshold)]
 
-    text_hash = hashlib.sha256(path.read_bytes()).hexdigest()
-    output_dir.mkdir(parents=True, exist_ok=True)
 
-    out = {
-        "file_sha256": text_hash,
-        "page_count": result.page_count,
-        "pages": page_payload,
-        "chunks": chunk_payload,
+def write_output(
+    sha256: str,
+    pages: list[tuple[int, str]],
+    page_count: int,
+    output_dir: Path,
+    compression: str = "gzip",
+    *,
+    ocr: OcrConfig | None = None,
+    ocr_results: dict[int, tuple[str, float]] | None = None,
+) -> dict:
+    ocr_results = ocr_results or {}
+    selected: list[tuple[int, str, str, float]] = []
+    for page_no, text in sorted(pages):
+        source = "text"
+        quality = text_quality(text)
+        if page_no in ocr_results and ocr_results[page_no][1] > quality:
+            text, quality = ocr_results[page_no]
+            source = "ocr"
+        selected.append((page_no, text, source, quality))
+    qualities = [quality for _, _, _, quality in selected]
+    ocr_quality = round(sum(qualities) / len(qualities), 4) if qualities else None
+
+    chunk_count = 0
+
+    def page_records():
+        nonlocal chunk_count
+        for page_no, text, source, quality in selected:
+            chunks = chunk_page_text(page_no, text)
+            chunk_count += len(chunks)
+            yield {
+                "page_no": page_no,
+                "text": text,
+                "source": source,
+                "quality": quality,
+                "chunks": chunk_offsets(chunks),
+            }
+
+    version = pipeline_version(ocr)
+    out_path = output_path(output_dir, sha256, compression)
+    write_processed(
+        out_path,
+        {
+            "file_sha256": sha256,
+            "pipeline_version": version,
+            "page_count": page_count,
+            "ocr_quality": ocr_quality,
+            "ocr_pages": sum(1 for _, _, source, _ in selected if source == "ocr"),
+        },
+        page_records(),
+    )
+
+    return {
+        "output": str(out_path),
+        "chunks": chunk_count,
+        "pipeline_version": version,
+        "ocr_quality": ocr_quality,
     }
 
-    out_path = output_dir / f"{text_hash}.json"
-    out_path.write_text(json.dumps(out, indent=2), encoding="utf-8")
 
-    return {"output": str(out_path), "chunks": len(chunks)}
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for block in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_current_output(file_meta: dict | None, version: str = PIPELINE_VERSION) -> bool:
+    if not file_meta or file_meta.get("pipeline_version") != version:
+        return False
+    output = file_meta.get("processed_output")
+    return bool(output) and Path(output).exists()
+
+
+def extract_range(path: str, start: int, end: int) -> tuple[list[tuple[int, str]], int]:
+    from extractor import extract_pdf_pages
+
+    result = extract_pdf_pages(Path(path), start, end)
+    return [(page.page_no, page.text) for page in result.pages], result.page_count
+
+
+def process_many(
+    items: Iterable[tuple[str, Path, str]],
+    output_dir: Path,
+    *,
+    workers: int = 1,
+    compression: str = "gzip",
+    ocr: OcrConfig | None = None,
+) -> Iterator[tuple[str, dict | None, str | None]]:
+    # Items are (key, path, sha256); yields (key, result, error) per file.
+    # Extraction runs in worker processes, split into PAGES_PER_TASK page
+    # ranges so one huge PDF is spread across workers. Once a document's text
+    # layer is in, only its low-quality pages go back to the pool for OCR.
+    # Chunking and writing happen in the parent.
+    if workers <= 1:
+        for key, path, sha256 in items:
+            try:
+                yield key, process_pdf(path, output_dir, sha256, compression, ocr), None
+            except Exception as exc:  # pragma: no cover - runtime safety
+                yield key, None, str(exc)
+        return
+
+    pending: dict[str, PendingDoc] = {}
+    in_flight: dict = {}
+    source = iter(items)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+
+        def submit(key: str, start: int) -> None:
+            future = pool.submit(
+                extract_range, str(pending[key].path), start, start + PAGES_PER_TASK
+            )
+            in_flight[future] = (key, "extract", start)
+
+        def submit_ocr(key: str, page_no: int) -> None:
+            future = pool.submit(ocr_page, str(pending[key].path), page_no, ocr)
+            in_flight[future] = (key, "ocr", page_no)
+
+        def fill() -> None:
+            while len(in_flight) < workers * 2:
+                item = next(source, None)
+                if item is None:
+                    return
+                key, path, sha256 = item
+                pending[key] = PendingDoc(path=path, sha256=sha256)
+                submit(key, 0)
+
+        fill()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, stage, start = in_flight.pop(future)
+                doc = pending[key]
+                doc.outstanding -= 1
+                if stage == "ocr":
+                    try:
+                        page_no, text, quality = future.result()
+                    except Exception:  # pragma: no cover - runtime safety
+                        pass
+                    else:
+                        doc.ocr_results[page_no] = (text, quality)
+                else:
+                    try:
+                        pages, page_count = future.result()
+                    except Exception as exc:  # pragma: no cover - runtime safety
+                        doc.error = doc.error or str(exc)
+                    else:
+                        doc.pages.extend(pages)
+                        if start == 0:
+                            doc.page_count = page_count
+                            for next_start in range(PAGES_PER_TASK, page_count, PAGES_PER_TASK):
+                                doc.outstanding += 1
+                                submit(key, next_start)
+                    if not doc.outstanding and not doc.error:
+                        for page_no in ocr_candidates(doc.pages, ocr):
+                            doc.outstanding += 1
+                            submit_ocr(key, page_no)
+
+                if doc.outstanding:
+                    continue
+                del pending[key]
+                if doc.error:
+                    yield key, None, doc.error
+                    continue
+                try:
+                    result = write_output(
+                        doc.sha256,
+                        doc.pages,
+                        doc.page_count,
+                        output_dir,
+                        compression,
+                        ocr=ocr,
+                        ocr_results=doc.ocr_results,
+                    )
+                except Exception as exc:  # pragma: no cover - runtime safety
+                    yield key, None, str(exc)
+                    continue
+                yield key, result, None
+            fill()
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import gzip
+import io
+import json
+import os
+from pathlib import Path
+from typing import IO, Iterable, Iterator
+
+from chunker import Chunk, chunk_page_text
+
+OUTPUT_FORMAT_VERSION = 2
+COMPRESSION_SUFFIXES = {"gzip": ".ndjson.gz", "zstd": ".ndjson.zst", "none": ".ndjson"}
+
+# Processed outputs are NDJSON record streams:
+#   {"type": "doc", "file_sha256": ..., "page_count": ..., ...}
+#   {"type": "page", "page_no": 1, "text": "...", "chunks": [[chunk_no, start, end], ...]}
+# Chunk text is page["text"][start:end], so each byte of text is stored once
+# and readers can walk a document page by page.
+
+
+def output_path(output_dir: Path, sha256: str, compression: str = "gzip") -> Path:
+    return output_dir / f"{sha256}{COMPRESSION_SUFFIXES[compression]}"
+
+
+def write_processed(
+    path: Path,
+    header: dict,
+    pages: Iterable[dict],
+) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open_text(tmp_path, "w") as handle:
+        handle.write(json.dumps({"type": "doc", "format": OUTPUT_FORMAT_VERSION, **header}))
+        handle.write("\n")
+        for page in pages:
+            handle.write(json.dumps({"type": "page", **page}, ensure_ascii=False))
+            handle.write("\n")
+    os.replace(tmp_path, path)
+
+
+def iter_records(path: Path) -> Iterator[dict]:
+    if path.suffix == ".json":
+        yield from iter_legacy_records(path)
+        return
+    with open_text(path, "r") as handle:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_header(path: Path) -> dict:
+    for record in iter_records(path):
+        return record
+    raise ValueError(f"Empty processed output: {path}")
+
+
+def iter_pages(path: Path) -> Iterator[dict]:
+    for record in iter_records(path):
+        if record.get("type") == "page":
+            yield record
+
+
+def iter_chunks(path: Path) -> Iterator[dict]:
+    for page in iter_pages(path):
+        text = page.get("text") or ""
+        for chunk_no, start, end in page.get("chunks", []):
+            yield {
+                "page_no": page["page_no"],
+                "chunk_no": chunk_no,
+                "text": text[start:end],
+                "start_char": start,
+                "end_char": end,
+            }
+
+
+def iter_legacy_records(path: Path) -> Iterator[dict]:
+    # Pretty-printed single-object outputs from before OUTPUT_FORMAT_VERSION 2.
+    payload = json.loads(path.read_text(encoding="utf-8"))
+    pages = payload.pop("pages", [])
+    payload.pop("chunks", None)
+    yield {"type": "doc", "format": 1, **payload}
+
+    # Legacy chunk offsets did not point into the page text; the paragraph
+    # split is unchanged, so recompute offsets from the stored page text.
+    for page in pages:
+        text = page.get("text") or ""
+        yield {
+            "type": "page",
+            "page_no": page["page_no"],
+            "text": text,
+            "chunks": chunk_offsets(chunk_page_text(page["page_no"], text)),
+        }
+
+
+def chunk_offsets(chunks: Iterable[Chunk]) -> list[list[int]]:
+    return [[chunk.chunk_no, chunk.start_char, chunk.end_char] for chunk in chunks]
+
+
+def open_text(path: Path, mode: str) -> IO[str]:
+    name = path.name.removesuffix(".tmp")
+    if name.endswith(".gz"):
+        return gzip.open(path, f"{mode}t", encoding="utf-8", compresslevel=6)
+    if name.endswith(".zst"):
+        try:
+            import zstandard
+        except ModuleNotFoundError as exc:  # pragma: no cover - optional dependency
+            raise ModuleNotFoundError(
+                "zstandard is required for .zst outputs. Install with: pip install zstandard"
+            ) from exc
+        raw = path.open(f"{mode}b")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor(level=3).stream_writer(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return path.open(mode, encoding="utf-8")
@@ -1,16 +1,34 @@
+import threading
 import time
+from urllib.parse import urlparse
 
 
-class RateLimiter:
-    def __init__(self, min_interval_seconds: float) -> None:
+class HostRateLimiter:
+    # One token per min_interval per host, up to `burst`. Tokens are reserved
+    # under the lock and slept off outside it, so hosts never block each other.
+
+    def __init__(self, min_interval_seconds: float, burst: int = 1) -> None:
         self.min_interval = max(0.0, min_interval_seconds)
-        self._last_time = 0.0
+        self.burst = max(1, burst)
+        self._lock = threading.Lock()
+        self._buckets: dict[str, tuple[float, float]] = {}
 
-    def wait(self) -> None:
+    def wait(self, url_or_host: str) -> None:
         if self.min_interval <= 0:
             return
-        now = time.monotonic()
-        elapsed = now - self._last_time
-        if elapsed < self.min_interval:
-            time.sleep(self.min_interval - elapsed)
-        self._last_time = time.monotonic()
+        host = host_key(url_or_host)
+        with self._lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(host, (float(self.burst), now))
+            tokens = min(float(self.burst), tokens + (now - updated) / self.min_interval)
+            tokens -= 1.0
+            self._buckets[host] = (tokens, now)
+            delay = -tokens * self.min_interval if tokens < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+
+
+def host_key(url_or_host: str) -> str:
+    if "://" in url_or_host:
+        return urlparse(url_or_host).netloc.lower()
+    return url_or_host.lower()
@@ -1,13 +1,403 @@
 import json
+import os
+import sqlite3
+import time
 from pathlib import Path
+from typing import Iterator
 
+LEGACY_STATE_NAME = "state.json"
+STATE_VERSION = 2
+PAGE_SIZE = 500
 
-def load_state(path: Path) -> dict:
-    if path.exists():
-        return json.loads(path.read_text(encoding="utf-8"))
-    return {"version": 1, "url_meta": {}, "files": {}}
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS url_meta (
+  url TEXT PRIMARY KEY,
+  meta TEXT NOT NULL,
+  sha256 TEXT,
+  processed_output TEXT,
+  blocked TEXT,
+  doc_id TEXT,
+  updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS url_meta_sha256_idx ON url_meta (sha256);
+CREATE INDEX IF NOT EXISTS url_meta_processed_output_idx ON url_meta (processed_output);
+CREATE INDEX IF NOT EXISTS url_meta_blocked_idx ON url_meta (blocked);
+CREATE INDEX IF NOT EXISTS url_meta_doc_id_idx ON url_meta (doc_id);
 
+CREATE TABLE IF NOT EXISTS files (
+  sha256 TEXT PRIMARY KEY,
+  meta TEXT NOT NULL
+);
 
-def save_state(path: Path, state: dict) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(state, indent=2), encoding="utf-8")
+CREATE TABLE IF NOT EXISTS partials (
+  url TEXT PRIMARY KEY,
+  meta TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS errors (
+  url TEXT PRIMARY KEY,
+  meta TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS listing_pages (
+  url TEXT PRIMARY KEY,
+  meta TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS kv (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS index_chunks (
+  url TEXT NOT NULL,
+  chunk_id TEXT NOT NULL,
+  fingerprint TEXT NOT NULL,
+  PRIMARY KEY (url, chunk_id)
+);
+CREATE INDEX IF NOT EXISTS index_chunks_chunk_id_idx ON index_chunks (chunk_id);
+
+CREATE TABLE IF NOT EXISTS run_items (
+  run_id TEXT NOT NULL,
+  item TEXT NOT NULL,
+  PRIMARY KEY (run_id, item)
+);
+"""
+
+KEYED_TABLES = {
+    "files": "sha256",
+    "partials": "url",
+    "errors": "url",
+    "listing_pages": "url",
+}
+
+
+class StateStore:
+    # SQLite (WAL) replacement for the old monolithic state.json. url_meta rows
+    # keep the full metadata as JSON plus a few indexed columns for lookups.
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        if self.get_kv("version") is None:
+            self.set_kv("version", STATE_VERSION)
+        self.conn.commit()
+
+    def __enter__(self) -> "StateStore":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+        self.conn.close()
+
+    def close(self) -> None:
+        self.conn.commit()
+        self.conn.close()
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def get_url(self, url: str) -> dict | None:
+        row = self.conn.execute(
+            "SELECT meta FROM url_meta WHERE url = ?", (url,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_url(self, url: str, meta: dict) -> None:
+        self.conn.execute(
+            """
+            INSERT INTO url_meta (url, meta, sha256, processed_output, blocked, doc_id, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+              meta = excluded.meta,
+              sha256 = excluded.sha256,
+              processed_output = excluded.processed_output,
+              blocked = excluded.blocked,
+              doc_id = excluded.doc_id,
+              updated_at = excluded.updated_at
+            """,
+            url_row(url, meta),
+        )
+
+    def iter_urls(
+        self,
+        *,
+        processed: bool | None = None,
+        blocked: bool | None = None,
+        sha256: str | None = None,
+        limit: int | None = None,
+    ) -> Iterator[tuple[str, dict]]:
+        # Keyset pages over the primary key keep memory flat and stay correct
+        # while callers write back rows during iteration.
+        where = []
+        params: list = []
+        if processed is not None:
+            where.append(f"processed_output IS {'NOT ' if processed else ''}NULL")
+        if blocked is not None:
+            where.append(f"blocked IS {'NOT ' if blocked else ''}NULL")
+        if sha256 is not None:
+            where.append("sha256 = ?")
+            params.append(sha256)
+        clause = "".join(f" AND {cond}" for cond in where)
+
+        last_url = ""
+        remaining = limit
+        while remaining is None or remaining > 0:
+            page = PAGE_SIZE if remaining is None else min(PAGE_SIZE, remaining)
+            rows = self.conn.execute(
+                f"SELECT url, meta FROM url_meta WHERE url > ?{clause} ORDER BY url LIMIT ?",
+                (last_url, *params, page),
+            ).fetchall()
+            if not rows:
+                return
+            for url, meta in rows:
+                yield url, json.loads(meta)
+            last_url = rows[-1][0]
+            if remaining is not None:
+                remaining -= len(rows)
+
+    def count_urls(self) -> int:
+        return self.conn.execute("SELECT count(*) FROM url_meta").fetchone()[0]
+
+    def get_file(self, sha256: str) -> dict | None:
+        return self._get("files", sha256)
+
+    def put_file(self, sha256: str, meta: dict) -> None:
+        self._put("files", sha256, meta)
+
+    def setdefault_file(self, sha256: str, meta: dict) -> None:
+        self.conn.execute(
+            "INSERT INTO files (sha256, meta) VALUES (?, ?) ON CONFLICT (sha256) DO NOTHING",
+            (sha256, json.dumps(meta)),
+        )
+
+    def get_partial(self, url: str) -> dict | None:
+        return self._get("partials", url)
+
+    def put_partial(self, url: str, meta: dict) -> None:
+        self._put("partials", url, meta)
+
+    def delete_partial(self, url: str) -> None:
+        self._delete("partials", url)
+
+    def put_error(self, url: str, error: dict) -> None:
+        self._put("errors", url, error)
+
+    def delete_error(self, url: str) -> None:
+        self._delete("errors", url)
+
+    def get_listing_page(self, url: str) -> dict | None:
+        return self._get("listing_pages", url)
+
+    def put_listing_page(self, url: str, meta: dict) -> None:
+        self._put("listing_pages", url, meta)
+
+    def get_kv(self, key: str):
+        row = self.conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_kv(self, key: str, value) -> None:
+        self.conn.execute(
+            "INSERT INTO kv (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value)),
+        )
+
+    def get_index_chunks(self, url: str) -> dict[str, str]:
+        # chunk_id -> fingerprint of what Meilisearch holds for this URL.
+        rows = self.conn.execute(
+            "SELECT chunk_id, fingerprint FROM index_chunks WHERE url = ?", (url,)
+        )
+        return dict(rows)
+
+    def put_index_chunks(self, rows: list[tuple[str, str, str]]) -> None:
+        self.conn.executemany(
+            "INSERT INTO index_chunks (url, chunk_id, fingerprint) VALUES (?, ?, ?) "
+            "ON CONFLICT (url, chunk_id) DO UPDATE SET fingerprint = excluded.fingerprint",
+            rows,
+        )
+
+    def delete_index_chunks(self, rows: list[tuple[str, str]]) -> None:
+        self.conn.executemany(
+            "DELETE FROM index_chunks WHERE url = ? AND chunk_id = ?", rows
+        )
+
+    def iter_orphaned_index_chunks(self) -> Iterator[tuple[str, str]]:
+        # Indexed chunks of URLs that no longer have a processed output.
+        rows = self.conn.execute(
+            """
+            SELECT i.url, i.chunk_id FROM index_chunks i
+            LEFT JOIN url_meta u ON u.url = i.url
+            WHERE u.processed_output IS NULL
+            ORDER BY i.url, i.chunk_id
+            """
+        ).fetchall()
+        yield from rows
+
+    def index_chunk_urls(self, chunk_id: str) -> set[str]:
+        # Identical files downloaded from several URLs share chunk ids.
+        rows = self.conn.execute(
+            "SELECT url FROM index_chunks WHERE chunk_id = ?", (chunk_id,)
+        )
+        return {url for (url,) in rows}
+
+    def import_json(self, legacy_path: Path) -> int:
+        state = json.loads(legacy_path.read_text(encoding="utf-8"))
+        url_meta = state.get("url_meta", {})
+        with self.conn:
+            self.conn.executemany(
+                """
+                INSERT OR REPLACE INTO url_meta
+                  (url, meta, sha256, processed_output, blocked, doc_id, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (url_row(url, meta) for url, meta in url_meta.items()),
+            )
+            for table, key_column in KEYED_TABLES.items():
+                self.conn.executemany(
+                    f"INSERT OR REPLACE INTO {table} ({key_column}, meta) VALUES (?, ?)",
+                    ((key, json.dumps(meta)) for key, meta in state.get(table, {}).items()),
+                )
+            self.set_kv("migrated_from", str(legacy_path))
+        return len(url_meta)
+
+    def export_json(self, output_path: Path) -> None:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = output_path.with_name(f".{output_path.name}.tmp")
+        with tmp_path.open("w", encoding="utf-8") as handle:
+            handle.write(f'{{"version": {STATE_VERSION}, "url_meta": {{')
+            for i, (url, meta) in enumerate(self.iter_urls()):
+                handle.write(f"{',' if i else ''}\n  {json.dumps(url)}: {json.dumps(meta)}")
+            handle.write("\n}")
+            for table, key_column in KEYED_TABLES.items():
+                handle.write(f', "{table}": {{')
+                rows = self.conn.execute(
+                    f"SELECT {key_column}, meta FROM {table} ORDER BY {key_column}"
+                )
+                for i, (key, meta) in enumerate(rows):
+                    handle.write(f"{',' if i else ''}\n  {json.dumps(key)}: {meta}")
+                handle.write("\n}")
+            handle.write("}\n")
+        os.replace(tmp_path, output_path)
+
+    def _get(self, table: str, key: str) -> dict | None:
+        row = self.conn.execute(
+            f"SELECT meta FROM {table} WHERE {KEYED_TABLES[table]} = ?", (key,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _put(self, table: str, key: str, meta: dict) -> None:
+        key_column = KEYED_TABLES[table]
+        self.conn.execute(
+            f"INSERT INTO {table} ({key_column}, meta) VALUES (?, ?) "
+            f"ON CONFLICT ({key_column}) DO UPDATE SET meta = excluded.meta",
+            (key, json.dumps(meta)),
+        )
+
+    def _delete(self, table: str, key: str) -> None:
+        self.conn.execute(f"DELETE FROM {table} WHERE {KEYED_TABLES[table]} = ?", (key,))
+
+
+class Checkpoint:
+    # Tracks one resumable run of a command. Items are marked done in the same
+    # SQLite transaction as their state updates, and the transaction is
+    # committed every `every_items` items or `every_seconds` seconds, so a
+    # killed run loses at most one checkpoint interval.
+
+    def __init__(
+        self,
+        store: StateStore,
+        command: str,
+        *,
+        input_key: str,
+        every_items: int = 100,
+        every_seconds: float = 30.0,
+        fresh: bool = False,
+    ) -> None:
+        self.store = store
+        self.key = f"run:{command}"
+        self.every_items = max(1, every_items)
+        self.every_seconds = max(0.0, every_seconds)
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+        previous = store.get_kv(self.key)
+        self.resumed = bool(previous) and previous["input"] == input_key and not fresh
+        if self.resumed:
+            self.run_id = previous["run_id"]
+        else:
+            if previous:
+                store.conn.execute(
+                    "DELETE FROM run_items WHERE run_id = ?", (previous["run_id"],)
+                )
+            self.run_id = f"{command}-{time.time_ns()}"
+            store.set_kv(
+                self.key,
+                {"run_id": self.run_id, "input": input_key, "started_at": time.time()},
+            )
+        store.commit()
+
+    def remaining(self, items: list[str]) -> list[str]:
+        if not self.resumed:
+            return list(items)
+        return [item for item in items if not self.is_done(item)]
+
+    def is_done(self, item: str) -> bool:
+        row = self.store.conn.execute(
+            "SELECT 1 FROM run_items WHERE run_id = ? AND item = ?",
+            (self.run_id, item),
+        ).fetchone()
+        return row is not None
+
+    def done(self, item: str) -> None:
+        self.store.conn.execute(
+            "INSERT OR IGNORE INTO run_items (run_id, item) VALUES (?, ?)",
+            (self.run_id, item),
+        )
+        self.pending += 1
+        if (
+            self.pending >= self.every_items
+            or time.monotonic() - self.last_flush >= self.every_seconds
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        self.store.commit()
+        self.pending = 0
+        self.last_flush = time.monotonic()
+
+    def finish(self) -> None:
+        self.store.conn.execute("DELETE FROM run_items WHERE run_id = ?", (self.run_id,))
+        self.store.conn.execute("DELETE FROM kv WHERE key = ?", (self.key,))
+        self.flush()
+
+
+def url_row(url: str, meta: dict) -> tuple:
+    return (
+        url,
+        json.dumps(meta),
+        meta.get("sha256"),
+        meta.get("processed_output"),
+        meta.get("blocked"),
+        meta.get("doc_id"),
+        time.time(),
+    )
+
+
+def open_state(path: Path) -> StateStore:
+    if path.suffix == ".json":
+        legacy_path, path = path, path.with_suffix(".sqlite3")
+    else:
+        legacy_path = path.with_name(LEGACY_STATE_NAME)
+    store = StateStore(path)
+    if legacy_path.exists() and store.get_kv("migrated_from") is None:
+        count = store.import_json(legacy_path)
+        print(f"Migrated {count} URLs from {legacy_path} into {path}")
+    return store
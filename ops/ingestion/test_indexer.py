@@ -0,0 +1,18 @@
+from __future__ import annotations
+
+import re
+
+from indexer import meili_chunk_id
+
+# Characters Meilisearch accepts in a document id (at most 511 bytes).
+MEILI_ID = re.compile(r"[A-Za-z0-9_-]{1,511}")
+
+
+def test_meili_chunk_id_is_a_valid_document_id() -> None:
+    chunk_id = meili_chunk_id("ab" * 32, 12, 3)
+    assert MEILI_ID.fullmatch(chunk_id)
+    assert chunk_id == f"{'ab' * 32}_12_3"
+
+
+def test_meili_chunk_id_without_page_is_valid() -> None:
+    assert MEILI_ID.fullmatch(meili_chunk_id("ab" * 32, None, None))
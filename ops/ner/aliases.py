@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+
+WORD_RE = re.compile(r"[^\W_]+")
+POSSESSIVE_RE = re.compile(r"['’]s\b")
+HONORIFICS = {
+    "mr", "mrs", "ms", "miss", "dr", "prof", "sir", "dame", "hon", "judge",
+    "justice", "sen", "senator", "rep", "gov", "governor", "president",
+    "det", "detective", "agent", "officer", "sgt", "capt", "lt",
+}
+NAME_SUFFIXES = {"jr", "sr", "ii", "iii", "iv", "esq", "phd", "md"}
+ORG_SUFFIXES = {"inc", "llc", "ltd", "corp", "corporation", "co", "company", "plc", "lp", "llp"}
+# Typo matching only looks at names at least this long; short names differ
+# by one letter far too often to be the same entity.
+MIN_FUZZY_LENGTH = 8
+
+
+@dataclass
+class EntityRow:
+    entity_id: str
+    text: str
+    entity_type: str
+    mentions: int
+    norm: str = ""
+    tokens: list[str] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        if not self.norm:
+            self.norm = normalize_name(self.text, self.entity_type)
+        self.tokens = self.norm.split()
+
+    @property
+    def preference(self) -> tuple:
+        # Survivor of a merge: a full name over a bare surname, mixed case
+        # over ALL CAPS for people (not for acronyms like FBI), then the most
+        # mentioned; the id breaks ties.
+        shouted = self.entity_type == "person" and self.text.isupper()
+        return (len(self.tokens) > 1, not shouted, self.mentions, self.entity_id)
+
+
+def normalize_name(text: str, entity_type: str = "other") -> str:
+    # Case, accents, punctuation and whitespace are folded; possessives,
+    # honorifics and name/company suffixes are dropped.
+    folded = unicodedata.normalize("NFKD", text)
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch)).casefold()
+    tokens = WORD_RE.findall(POSSESSIVE_RE.sub("", folded))
+    if tokens and tokens[0] == "the":
+        tokens = tokens[1:]
+    if entity_type == "person":
+        while len(tokens) > 1 and tokens[0] in HONORIFICS:
+            tokens = tokens[1:]
+        while len(tokens) > 1 and tokens[-1] in NAME_SUFFIXES:
+            tokens = tokens[:-1]
+    elif entity_type == "org":
+        while len(tokens) > 1 and tokens[-1] in ORG_SUFFIXES:
+            tokens = tokens[:-1]
+    return " ".join(tokens) or " ".join(folded.split())
+
+
+def token_matches(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    if len(a) == 1:
+        return b.startswith(a)
+    if len(b) == 1:
+        return a.startswith(b)
+    return False
+
+
+def person_compatible(a: list[str], b: list[str]) -> bool:
+    # Same surname, and every given name / initial of the shorter name
+    # appears in order in the longer one ("j epstein", "jeffrey e epstein"
+    # and "epstein" are all compatible with "jeffrey epstein").
+    short, long = (a, b) if len(a) <= len(b) else (b, a)
+    if not short or short[-1] != long[-1]:
+        return False
+    i = 0
+    for token in short[:-1]:
+        while i < len(long) - 1 and not token_matches(token, long[i]):
+            i += 1
+        if i >= len(long) - 1:
+            return False
+        i += 1
+    return True
+
+
+def similar(a: str, b: str, threshold: float) -> bool:
+    # difflib ratio with cheap upper bounds first: lengths, then shared
+    # character counts, before the full matching-blocks computation.
+    total = len(a) + len(b)
+    if 2 * min(len(a), len(b)) < threshold * total:
+        return False
+    if 2 * sum((Counter(a) & Counter(b)).values()) < threshold * total:
+        return False
+    return SequenceMatcher(None, a, b, autojunk=False).ratio() >= threshold
+
+
+class UnionFind:
+    def __init__(self) -> None:
+        self.parent: dict[str, str] = {}
+
+    def find(self, item: str) -> str:
+        parent = self.parent.setdefault(item, item)
+        if parent != item:
+            parent = self.parent[item] = self.find(parent)
+        return parent
+
+    def union(self, a: str, b: str) -> None:
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[root_b] = root_a
+
+
+def cluster_entities(
+    entities: list[EntityRow], *, window: int = 5, similarity: float = 0.92
+) -> tuple[dict[str, str], set[tuple[str, str, str]]]:
+    # Returns ({merged entity id: survivor id}, {(alias, type, survivor id)}).
+    # Nothing is compared pairwise across the whole set:
+    #   1. identical normalized names are grouped by hash;
+    #   2. person names are blocked by surname (and first initial); longest
+    #      first, each name attaches to the single compatible name already
+    #      seen in its block, and stays apart when that is ambiguous ("j
+    #      smith" with both "john smith" and "jane smith");
+    #   3. a sorted-neighbourhood pass (forward and reversed keys, `window`
+    #      neighbours) merges near-identical spellings such as OCR typos.
+    groups = UnionFind()
+
+    exact: dict[tuple[str, str], list[EntityRow]] = defaultdict(list)
+    for entity in entities:
+        groups.find(entity.entity_id)
+        exact[(entity.entity_type, entity.norm)].append(entity)
+    heads: list[EntityRow] = []
+    for members in exact.values():
+        head = max(members, key=lambda entity: entity.preference)
+        for member in members:
+            groups.union(head.entity_id, member.entity_id)
+        heads.append(head)
+
+    blocks: dict[str, list[EntityRow]] = defaultdict(list)
+    for head in heads:
+        if head.entity_type == "person" and head.tokens:
+            blocks[head.tokens[-1]].append(head)
+    for block in blocks.values():
+        if len(block) < 2:
+            continue
+        reps_by_initial: dict[str, list[EntityRow]] = defaultdict(list)
+        reps: list[EntityRow] = []
+        for entity in sorted(
+            block, key=lambda entity: (len(entity.tokens), entity.preference), reverse=True
+        ):
+            tokens = entity.tokens
+            if len(tokens) == 1:
+                candidates = reps
+            else:
+                candidates = reps_by_initial.get(tokens[0][0], [])
+            matches = [rep for rep in candidates if person_compatible(tokens, rep.tokens)]
+            if len(matches) == 1 and (len(tokens) > 1 or len(reps) == 1):
+                groups.union(matches[0].entity_id, entity.entity_id)
+            elif not matches and len(tokens) > 1:
+                reps_by_initial[tokens[0][0]].append(entity)
+                reps.append(entity)
+
+    if similarity < 1.0:
+        for key in (lambda entity: entity.norm, lambda entity: entity.norm[::-1]):
+            ordered = sorted(heads, key=lambda entity: (entity.entity_type, key(entity)))
+            for i, entity in enumerate(ordered):
+                if len(entity.norm) < MIN_FUZZY_LENGTH:
+                    continue
+                for other in ordered[i + 1 : i + 1 + window]:
+                    if other.entity_type != entity.entity_type:
+                        break
+                    if (
+                        len(other.norm) < MIN_FUZZY_LENGTH
+                        or len(other.tokens) != len(entity.tokens)
+                        or groups.find(other.entity_id) == groups.find(entity.entity_id)
+                    ):
+                        continue
+                    if not similar(entity.norm, other.norm, similarity):
+                        continue
+                    groups.union(entity.entity_id, other.entity_id)
+
+    clusters: dict[str, list[EntityRow]] = defaultdict(list)
+    for entity in entities:
+        clusters[groups.find(entity.entity_id)].append(entity)
+
+    merges: dict[str, str] = {}
+    aliases: set[tuple[str, str, str]] = set()
+    for members in clusters.values():
+        survivor = max(members, key=lambda entity: entity.preference)
+        for member in members:
+            if member.entity_id != survivor.entity_id:
+                merges[member.entity_id] = survivor.entity_id
+            aliases.add((member.norm, survivor.entity_type, survivor.entity_id))
+    return merges, aliases
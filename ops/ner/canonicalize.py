@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import os
+import time
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Canonicalize entities: merge aliases and near-duplicate names"
+    )
+    parser.add_argument(
+        "--database-url",
+        default="",
+        help="Postgres connection string (or set DATABASE_URL)",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=5,
+        help="Sorted-neighbourhood window for near-duplicate spellings",
+    )
+    parser.add_argument(
+        "--similarity",
+        type=float,
+        default=0.92,
+        help="Min similarity ratio for near-duplicate spellings (1.0 disables)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the merges without writing them",
+    )
+    return parser
+
+
+def main() -> None:
+    parser = build_parser()
+    args = parser.parse_args()
+
+    database_url = args.database_url or os.environ.get("DATABASE_URL", "")
+    if not database_url:
+        raise SystemExit("DATABASE_URL is required")
+
+    try:
+        import psycopg
+    except ModuleNotFoundError as exc:  # pragma: no cover - runtime dependency
+        raise ModuleNotFoundError(
+            "psycopg is required. Install with: pip install -r ops/requirements.txt"
+        ) from exc
+
+    from aliases import cluster_entities
+    from db import apply_merges, iter_entity_rows
+
+    started = time.perf_counter()
+    with psycopg.connect(database_url) as conn:
+        entities = list(iter_entity_rows(conn))
+        merges, aliases = cluster_entities(
+            entities, window=args.window, similarity=args.similarity
+        )
+
+        if args.dry_run:
+            names = {entity.entity_id: entity.text for entity in entities}
+            for old_id, new_id in sorted(merges.items(), key=lambda item: names[item[1]]):
+                print(f"{names[old_id]!r} -> {names[new_id]!r}")
+            deleted = mentions = 0
+        else:
+            with conn.cursor() as cur:
+                deleted, mentions = apply_merges(cur, merges=merges, aliases=aliases)
+            conn.commit()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"Canonicalized {len(entities)} entities: {len(merges)} merged "
+        f"({deleted} deleted, {mentions} mentions repointed), "
+        f"{len(aliases)} aliases in {elapsed:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,9 @@
 from __future__ import annotations
 
 import argparse
+import itertools
 import os
+import time
 
 
 def build_parser() -> argparse.ArgumentParser:
@@ -15,14 +17,31 @@ def build_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--limit",
         type=int,
-        default=1000,
-        help="Max number of chunks to process",
+        default=None,
+        help="Max number of chunks to process in this run (default: all remaining)",
     )
     parser.add_argument(
-        "--offset",
+        "--restart",
+        action="store_true",
+        help="Ignore the saved cursor and start from the first chunk",
+    )
+    parser.add_argument(
+        "--batch-size",
         type=int,
-        default=0,
-        help="Offset for chunk selection",
+        default=256,
+        help="Chunks per nlp.pipe batch and per commit",
+    )
+    parser.add_argument(
+        "--n-process",
+        type=int,
+        default=1,
+        help="spaCy worker processes for nlp.pipe",
+    )
+    parser.add_argument(
+        "--entity-cache-size",
+        type=int,
+        default=100_000,
+        help="Max (canonical_text, type) -> id entries kept in memory",
     )
     return parser
 
@@ -42,39 +61,83 @@ def main() -> None:
             "psycopg is required. Install with: pip install -r ops/requirements.txt"
         ) from exc
 
-    from db import insert_mentions
-    from extract import extract_entities
-    from model import load_model
+    from db import EntityCache, iter_pending_chunks, open_job, replace_chunk_mentions, save_job
+    from extract import extract_entities_batch
+    from model import load_model, model_id
 
     nlp = load_model()
+    model = model_id(nlp)
+    processed = 0
 
     with psycopg.connect(database_url) as conn:
         with conn.cursor() as cur:
-            cur.execute(
-                """
-                SELECT id, doc_id, page_no, text
-                FROM chunks
-                WHERE text IS NOT NULL AND text <> ''
-                ORDER BY id
-                LIMIT %s OFFSET %s
-                """,
-                (args.limit, args.offset),
+            job_id, stats = open_job(cur, "ner", restart=args.restart)
+            conn.commit()
+            entities = EntityCache(args.entity_cache_size)
+            entities.warm(cur)
+            cursor = stats.get("cursor")
+            if cursor:
+                print(f"Resuming NER job {job_id} after chunk {cursor}")
+
+            rows = iter_pending_chunks(
+                conn,
+                model=model,
+                after=tuple(cursor) if cursor else None,
+                page_size=args.batch_size,
             )
-            rows = cur.fetchall()
+            if args.limit is not None:
+                rows = itertools.islice(rows, args.limit)
 
-            for chunk_id, doc_id, page_no, text in rows:
-                mentions = extract_entities(text, nlp)
-                insert_mentions(
+            started = time.perf_counter()
+            results = extract_entities_batch(
+                ((chunk.text, chunk) for chunk in rows),
+                nlp,
+                batch_size=args.batch_size,
+                n_process=args.n_process,
+            )
+            stats["model"] = model
+            committed = dict(stats)
+            batch = []
+
+            def flush() -> None:
+                nonlocal committed
+                stats["mentions"] = stats.get("mentions", 0) + replace_chunk_mentions(
                     cur,
-                    doc_id=str(doc_id),
-                    page_no=int(page_no),
-                    chunk_id=str(chunk_id),
-                    mentions=mentions,
+                    model=model,
+                    results=[(chunk, mentions) for mentions, chunk in batch],
+                    entities=entities,
                 )
+                stats["chunks"] = stats.get("chunks", 0) + len(batch)
+                stats["cursor"] = list(batch[-1][1].key)
+                save_job(cur, job_id, stats=stats)
+                conn.commit()
+                committed = dict(stats)
+                batch.clear()
+
+            try:
+                # A batch's mentions, chunk_ner_state rows and the cursor are
+                # committed together, so a killed run resumes after the last
+                # committed batch and never leaves duplicate mentions.
+                for result in results:
+                    batch.append(result)
+                    processed += 1
+                    if len(batch) >= args.batch_size:
+                        flush()
+                if batch:
+                    flush()
+            except BaseException as exc:
+                conn.rollback()
+                save_job(cur, job_id, stats=committed, status="failed", error=repr(exc))
+                conn.commit()
+                raise
 
+            exhausted = args.limit is None or processed < args.limit
+            save_job(cur, job_id, stats=stats, status="done" if exhausted else "queued")
             conn.commit()
+            elapsed = time.perf_counter() - started
 
-    print(f"Processed {len(rows)} chunks")
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    print(f"Processed {processed} chunks in {elapsed:.1f}s ({rate:.1f} chunks/s)")
 
 
 if __name__ == "__main__":
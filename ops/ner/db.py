@@ -1,51 +1,373 @@
 from __future__ import annotations
 
-from typing import Iterable
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterator
 
+from aliases import EntityRow, normalize_name
 from extract import EntityMention
 
+ChunkKey = tuple[str, int, int]
+EntityKey = tuple[str, str]
+
+MENTION_COLUMNS = (
+    "entity_id",
+    "doc_id",
+    "page_no",
+    "chunk_id",
+    "mention_text",
+    "start_char",
+    "end_char",
+    "confidence",
+)
+
+
+class EntityCache:
+    # LRU-bounded (alias, type) -> entity id map, where alias is the
+    # normalized name (aliases.normalize_name), so "JEFFREY EPSTEIN" and
+    # "Jeffrey Epstein" resolve to one entity and merged names follow their
+    # survivor. Misses are resolved once per batch through entity_aliases,
+    # creating entities for names never seen before, so hot entities cost no
+    # round trips and their rows are not rewritten on every mention.
+
+    def __init__(self, max_size: int = 100_000) -> None:
+        self.max_size = max(1, max_size)
+        self.ids: OrderedDict[EntityKey, str] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def warm(self, cur) -> int:
+        cur.execute(
+            """
+            SELECT alias, type::text, entity_id FROM entity_aliases
+            ORDER BY created_at DESC
+            LIMIT %s
+            """,
+            (self.max_size,),
+        )
+        for alias, entity_type, entity_id in cur.fetchall():
+            self.ids[(alias, entity_type)] = str(entity_id)
+        return len(self.ids)
+
+    def resolve(self, cur, names: set[EntityKey]) -> dict[EntityKey, str]:
+        # names are raw (mention text, type) pairs; returns them mapped to ids.
+        keys: dict[EntityKey, EntityKey] = {
+            (text, entity_type): (normalize_name(text, entity_type), entity_type)
+            for text, entity_type in names
+        }
+        found: dict[EntityKey, str] = {}
+        missing: dict[EntityKey, str] = {}
+        for (text, _), key in keys.items():
+            entity_id = self.ids.get(key)
+            if entity_id is not None:
+                self.ids.move_to_end(key)
+                found[key] = entity_id
+            else:
+                # The first spelling seen becomes canonical_text of a new entity.
+                missing.setdefault(key, text)
+
+        if missing:
+            aliases = [alias for alias, _ in missing]
+            types = [entity_type for _, entity_type in missing]
+            found.update(self.lookup(cur, aliases, types))
+            new = {key: text for key, text in missing.items() if key not in found}
+            if new:
+                new_aliases = [alias for alias, _ in new]
+                new_types = [entity_type for _, entity_type in new]
+                texts = list(new.values())
+                cur.execute(
+                    """
+                    INSERT INTO entities (canonical_text, type)
+                    SELECT * FROM unnest(%s::text[], %s::entity_type[])
+                    ON CONFLICT (canonical_text, type) DO NOTHING
+                    """,
+                    (texts, new_types),
+                )
+                cur.execute(
+                    """
+                    INSERT INTO entity_aliases (alias, type, entity_id)
+                    SELECT k.alias, k.type, e.id
+                    FROM unnest(%s::text[], %s::text[], %s::entity_type[])
+                      AS k(alias, canonical_text, type)
+                    JOIN entities e ON e.canonical_text = k.canonical_text AND e.type = k.type
+                    ON CONFLICT (alias, type) DO NOTHING
+                    """,
+                    (new_aliases, texts, new_types),
+                )
+                found.update(self.lookup(cur, new_aliases, new_types))
+            for key in missing:
+                if key in found:
+                    self.ids[key] = found[key]
+
+        while len(self.ids) > self.max_size:
+            self.ids.popitem(last=False)
+        return {name: found[key] for name, key in keys.items() if key in found}
+
+    def lookup(self, cur, aliases: list[str], types: list[str]) -> dict[EntityKey, str]:
+        cur.execute(
+            """
+            SELECT a.alias, a.type::text, a.entity_id
+            FROM entity_aliases a
+            JOIN unnest(%s::text[], %s::entity_type[]) AS k(alias, type)
+              ON a.alias = k.alias AND a.type = k.type
+            """,
+            (aliases, types),
+        )
+        return {(alias, entity_type): str(entity_id) for alias, entity_type, entity_id in cur}
+
+
+@dataclass
+class ChunkRow:
+    chunk_id: str
+    doc_id: str
+    page_no: int
+    chunk_no: int
+    text: str
+    chunk_sha256: str | None
+
+    @property
+    def key(self) -> ChunkKey:
+        return (self.doc_id, self.page_no, self.chunk_no)
+
+
+def iter_pending_chunks(
+    conn, *, model: str, after: ChunkKey | None = None, page_size: int = 1000
+) -> Iterator[ChunkRow]:
+    # Keyset pagination over the (doc_id, page_no, chunk_no) unique index:
+    # every page is an index range scan no matter how far in it starts, and
+    # chunks of one document stay together. Only chunks that were never run,
+    # were run with another model, or whose text hash changed are returned.
+    with conn.cursor() as cur:
+        while True:
+            key_clause = "AND (c.doc_id, c.page_no, c.chunk_no) > (%s, %s, %s)" if after else ""
+            cur.execute(
+                f"""
+                SELECT c.id, c.doc_id, c.page_no, c.chunk_no, c.text, c.chunk_sha256
+                FROM chunks c
+                LEFT JOIN chunk_ner_state s ON s.chunk_id = c.id
+                WHERE c.text IS NOT NULL AND c.text <> ''
+                  {key_clause}
+                  AND (
+                    s.chunk_id IS NULL
+                    OR s.model <> %s
+                    OR s.chunk_sha256 IS DISTINCT FROM c.chunk_sha256
+                  )
+                ORDER BY c.doc_id, c.page_no, c.chunk_no
+                LIMIT %s
+                """,
+                (*(after or ()), model, page_size),
+            )
+            rows = [
+                ChunkRow(str(chunk_id), str(doc_id), page_no, chunk_no, text, chunk_sha256)
+                for chunk_id, doc_id, page_no, chunk_no, text, chunk_sha256 in cur.fetchall()
+            ]
+            if not rows:
+                return
+            yield from rows
+            after = rows[-1].key
+
+
+def replace_chunk_mentions(
+    cur,
+    *,
+    model: str,
+    results: list[tuple[ChunkRow, list[EntityMention]]],
+    entities: EntityCache,
+) -> int:
+    # Runs inside the caller's transaction: old mentions of the batch's chunks
+    # are dropped and the new ones COPY'd in together with chunk_ner_state, so
+    # a chunk never ends up with duplicate or half-replaced mentions.
+    if not results:
+        return 0
+    entity_ids = entities.resolve(
+        cur,
+        {(mention.text, mention.entity_type) for _, mentions in results for mention in mentions},
+    )
+
+    chunk_ids = [chunk.chunk_id for chunk, _ in results]
+    cur.execute("DELETE FROM entity_mentions WHERE chunk_id = ANY(%s::uuid[])", (chunk_ids,))
+    count = 0
+    with cur.copy(f"COPY entity_mentions ({', '.join(MENTION_COLUMNS)}) FROM STDIN") as copy:
+        for chunk, mentions in results:
+            for mention in mentions:
+                entity_id = entity_ids.get((mention.text, mention.entity_type))
+                if not entity_id:
+                    continue
+                copy.write_row(
+                    (
+                        entity_id,
+                        chunk.doc_id,
+                        chunk.page_no,
+                        chunk.chunk_id,
+                        mention.text,
+                        mention.start_char,
+                        mention.end_char,
+                        None,
+                    )
+                )
+                count += 1
+    cur.executemany(
+        """
+        INSERT INTO chunk_ner_state (chunk_id, model, chunk_sha256, processed_at)
+        VALUES (%s, %s, %s, now())
+        ON CONFLICT (chunk_id) DO UPDATE SET
+          model = EXCLUDED.model,
+          chunk_sha256 = EXCLUDED.chunk_sha256,
+          processed_at = EXCLUDED.processed_at
+        """,
+        [(chunk.chunk_id, model, chunk.chunk_sha256) for chunk, _ in results],
+    )
+    return count
+
+
+def open_job(cur, job_type: str, *, restart: bool = False) -> tuple[str, dict]:
+    # The newest unfinished job of this type carries the durable cursor in
+    # jobs.stats; resume it unless asked to start over.
+    if restart:
+        cur.execute(
+            """
+            UPDATE jobs SET status = 'failed', error = 'superseded by --restart',
+              ended_at = now(), updated_at = now()
+            WHERE job_type = %s AND status <> 'done'
+            """,
+            (job_type,),
+        )
+    else:
+        cur.execute(
+            """
+            SELECT id, stats FROM jobs
+            WHERE job_type = %s AND status <> 'done'
+            ORDER BY created_at DESC
+            LIMIT 1
+            """,
+            (job_type,),
+        )
+        row = cur.fetchone()
+        if row:
+            cur.execute(
+                "UPDATE jobs SET status = 'running', error = NULL, updated_at = now() WHERE id = %s",
+                (row[0],),
+            )
+            return str(row[0]), row[1] or {}
 
-def upsert_entity(cur, text: str, entity_type: str) -> str:
     cur.execute(
         """
-        INSERT INTO entities (canonical_text, type)
-        VALUES (%s, %s)
-        ON CONFLICT (canonical_text, type)
-        DO UPDATE SET canonical_text = EXCLUDED.canonical_text
+        INSERT INTO jobs (job_type, status, started_at, stats)
+        VALUES (%s, 'running', now(), '{}')
         RETURNING id
         """,
-        (text, entity_type),
+        (job_type,),
     )
-    row = cur.fetchone()
-    return str(row[0]) if row else ""
+    return str(cur.fetchone()[0]), {}
 
 
-def insert_mentions(
-    cur,
-    *,
-    doc_id: str,
-    page_no: int,
-    chunk_id: str,
-    mentions: Iterable[EntityMention],
+def save_job(
+    cur, job_id: str, *, stats: dict, status: str | None = None, error: str | None = None
 ) -> None:
-    for mention in mentions:
-        entity_id = upsert_entity(cur, mention.text, mention.entity_type)
-        if not entity_id:
-            continue
+    from psycopg.types.json import Jsonb
+
+    cur.execute(
+        """
+        UPDATE jobs SET
+          stats = %s,
+          status = COALESCE(%s::job_status, status),
+          error = %s,
+          ended_at = CASE WHEN %s::job_status IN ('done', 'failed') THEN now() ELSE ended_at END,
+          updated_at = now()
+        WHERE id = %s
+        """,
+        (Jsonb(stats), status, error, status, job_id),
+    )
+
+
+def iter_entity_rows(conn, *, fetch_size: int = 50_000) -> Iterator[EntityRow]:
+    # Server-side cursor; mention counts come from one grouped scan of the
+    # entity_id index rather than a subquery per entity.
+    with conn.cursor(name="canonical_entities") as cur:
+        cur.itersize = fetch_size
         cur.execute(
             """
-            INSERT INTO entity_mentions
-              (entity_id, doc_id, page_no, chunk_id, mention_text, start_char, end_char, confidence)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """,
-            (
-                entity_id,
-                doc_id,
-                page_no,
-                chunk_id,
-                mention.text,
-                mention.start_char,
-                mention.end_char,
-                None,
-            ),
+            SELECT e.id, e.canonical_text, e.type::text, coalesce(m.mentions, 0)
+            FROM entities e
+            LEFT JOIN (
+              SELECT entity_id, count(*) AS mentions
+              FROM entity_mentions
+              GROUP BY entity_id
+            ) m ON m.entity_id = e.id
+            """
+        )
+        for entity_id, text, entity_type, mentions in cur:
+            yield EntityRow(str(entity_id), text, entity_type, mentions)
+
+
+def apply_merges(
+    cur, *, merges: dict[str, str], aliases: set[tuple[str, str, str]]
+) -> tuple[int, int]:
+    # One transaction: repoint mentions of merged entities to their survivor,
+    # point every alias at its survivor, then delete the merged entities
+    # (their edges cascade). chunk_ner_state.processed_at is bumped for the
+    # affected chunks so the next incremental graph run rebuilds their docs.
+    cur.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS entity_merge (
+          old_id uuid PRIMARY KEY,
+          new_id uuid NOT NULL
         )
+        """
+    )
+    cur.execute(
+        """
+        CREATE TEMP TABLE IF NOT EXISTS entity_alias_batch (
+          alias text NOT NULL,
+          type entity_type NOT NULL,
+          entity_id uuid NOT NULL
+        )
+        """
+    )
+    cur.execute("TRUNCATE entity_merge, entity_alias_batch")
+    with cur.copy("COPY entity_merge (old_id, new_id) FROM STDIN") as copy:
+        for old_id, new_id in merges.items():
+            copy.write_row((old_id, new_id))
+    with cur.copy("COPY entity_alias_batch (alias, type, entity_id) FROM STDIN") as copy:
+        for row in aliases:
+            copy.write_row(row)
+
+    cur.execute(
+        """
+        UPDATE chunk_ner_state s SET processed_at = now()
+        FROM (
+          SELECT DISTINCT m.chunk_id
+          FROM entity_mentions m
+          JOIN entity_merge x ON x.old_id = m.entity_id
+        ) c
+        WHERE s.chunk_id = c.chunk_id
+        """
+    )
+    cur.execute(
+        """
+        UPDATE entity_mentions m SET entity_id = x.new_id
+        FROM entity_merge x
+        WHERE m.entity_id = x.old_id
+        """
+    )
+    mentions = cur.rowcount
+    cur.execute(
+        """
+        INSERT INTO entity_aliases (alias, type, entity_id)
+        SELECT alias, type, entity_id FROM entity_alias_batch
+        ON CONFLICT (alias, type) DO UPDATE SET entity_id = EXCLUDED.entity_id
+        WHERE entity_aliases.entity_id IS DISTINCT FROM EXCLUDED.entity_id
+        """
+    )
+    # Aliases left on merged entities by earlier runs follow the survivor;
+    # the FK cascade would otherwise drop them with the entity.
+    cur.execute(
+        """
+        UPDATE entity_aliases a SET entity_id = x.new_id
+        FROM entity_merge x
+        WHERE a.entity_id = x.old_id
+        """
+    )
+    cur.execute("DELETE FROM entities e USING entity_merge x WHERE e.id = x.old_id")
+    return cur.rowcount, mentions
@@ -1,8 +1,16 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from typing import Iterable, Iterator, TypeVar
 
 from spacy.language import Language
+from spacy.tokens import Doc
+
+T = TypeVar("T")
+
+# Bump when the mentions produced for the same text and model would change
+# (e.g. LABEL_MAP edits); chunk_ner_state rows from older versions are re-run.
+EXTRACT_VERSION = 1
 
 LABEL_MAP = {
     "PERSON": "person",
@@ -22,7 +30,25 @@ class EntityMention:
 
 
 def extract_entities(text: str, nlp: Language) -> list[EntityMention]:
-    doc = nlp(text)
+    return mentions_from_doc(nlp(text))
+
+
+def extract_entities_batch(
+    items: Iterable[tuple[str, T]],
+    nlp: Language,
+    *,
+    batch_size: int = 256,
+    n_process: int = 1,
+) -> Iterator[tuple[list[EntityMention], T]]:
+    # Streams (text, context) pairs through nlp.pipe so spaCy can batch them
+    # (and fan out to n_process workers); yields (mentions, context) in order.
+    for doc, context in nlp.pipe(
+        items, as_tuples=True, batch_size=batch_size, n_process=n_process
+    ):
+        yield mentions_from_doc(doc), context
+
+
+def mentions_from_doc(doc: Doc) -> list[EntityMention]:
     mentions: list[EntityMention] = []
     for ent in doc.ents:
         entity_type = LABEL_MAP.get(ent.label_, "other")
@@ -4,15 +4,43 @@ import os
 
 import spacy
 
+from extract import EXTRACT_VERSION
+
 DEFAULT_MODEL = "en_core_web_sm"
+NER_PIPES = ("ner", "entity_ruler")
 
 
 def load_model() -> spacy.language.Language:
     model_name = os.environ.get("SPACY_MODEL", DEFAULT_MODEL)
     try:
-        return spacy.load(model_name)
+        nlp = spacy.load(model_name)
     except OSError as exc:  # pragma: no cover - runtime dependency
         raise RuntimeError(
             f"spaCy model '{model_name}' not found. Install with: "
             f"python -m spacy download {model_name}"
         ) from exc
+
+    # Only entities are used: keep the NER pipes and any shared tok2vec /
+    # transformer they listen to, and disable the rest (tagger, parser,
+    # lemmatizer, ...).
+    unused = [
+        name
+        for name in nlp.pipe_names
+        if name not in NER_PIPES and not feeds_ner(nlp, name)
+    ]
+    nlp.select_pipes(disable=unused)
+    return nlp
+
+
+def feeds_ner(nlp: spacy.language.Language, name: str) -> bool:
+    listeners = getattr(nlp.get_pipe(name), "listening_components", None) or []
+    return any(listener in NER_PIPES for listener in listeners)
+
+
+def model_id(nlp: spacy.language.Language) -> str:
+    # Recorded per chunk in chunk_ner_state; a different value re-runs NER.
+    meta = nlp.meta
+    return (
+        f"{meta.get('lang')}_{meta.get('name')}-{meta.get('version')}"
+        f".extract-{EXTRACT_VERSION}"
+    )